@@ -0,0 +1,97 @@
+"""
+Upload Admission
+Rejects uploads that are too large or would exceed the user's quota from
+the request headers alone, before any of the body is read or parsed. The
+quota is enforced for good when the file's row is inserted, against the
+stored size rather than the declared one.
+"""
+from flask import request, flash, redirect, url_for, jsonify
+from flask_login import current_user
+from werkzeug.wsgi import LimitedStream
+from models import db, UserUsage
+from usage import get_usage
+from config import USER_QUOTA
+from functools import wraps
+
+
+def storage_used(user_id):
+    """Total bytes stored by a user, from their usage counters"""
+    return get_usage(user_id).total_bytes
+
+
+def quota_exceeded(user_id, incoming_size):
+    """Check whether storing incoming_size more bytes would take a user over USER_QUOTA"""
+    if not USER_QUOTA:
+        return False
+    return storage_used(user_id) + incoming_size > USER_QUOTA
+
+
+class QuotaExceeded(Exception):
+    """Raised when a new file takes its owner over USER_QUOTA"""
+
+    def __init__(self, message='Upload would exceed your storage quota.'):
+        super().__init__(message)
+
+
+def enforce_quota(user_id):
+    """
+    Raise QuotaExceeded if a user's counters, including files added in the
+    current transaction, are over USER_QUOTA
+
+    Called right after a file's size is added to the usage row. That
+    increment locks the row until the transaction ends, so concurrent
+    uploads are counted one after the other and can't all fit under the
+    limit by checking it at the same time.
+    """
+    if not USER_QUOTA:
+        return
+    total_bytes = db.session.query(UserUsage.total_bytes).filter(UserUsage.user_id == user_id).scalar()
+    if (total_bytes or 0) > USER_QUOTA:
+        raise QuotaExceeded()
+
+
+def wants_json():
+    """Whether the client asked for a JSON reply instead of a redirect (the live dashboard does)"""
+    return request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+
+
+def admit_upload(max_body_size, json_errors=False, check_quota=True):
+    """
+    Decorator admitting an upload request before its body is read
+
+    Content-Length is checked against max_body_size and, if USER_QUOTA is
+    set, against the user's remaining quota. Admitted requests get their
+    input stream capped at max_body_size, so clients sending more than
+    they declared (or streaming without a length) are cut off with a 413
+    as soon as they pass the limit. Bodies without a length are only turned
+    away here if the user is already over quota; their size is checked
+    when the file is recorded (see enforce_quota).
+
+    Args:
+        max_body_size: Largest acceptable request body in bytes
+        json_errors: Always reject with a JSON error; otherwise only clients
+            asking for one (see wants_json) get JSON instead of flash and redirect
+        check_quota: Whether the body counts against the user's quota
+    """
+    def reject(message):
+        if json_errors or wants_json():
+            return jsonify({'error': message}), 413
+        flash(message, 'error')
+        return redirect(url_for('files.dashboard'))
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            content_length = request.content_length
+            if content_length is not None and content_length > max_body_size:
+                return reject(f'Upload exceeds maximum allowed size ({max_body_size // (1024*1024)}MB).')
+
+            if check_quota and quota_exceeded(current_user.id, content_length or 0):
+                return reject('Upload would exceed your storage quota.')
+
+            request.environ['wsgi.input'] = LimitedStream(
+                request.environ['wsgi.input'], max_body_size, is_max=True
+            )
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,150 @@
+"""
+File Listing API
+JSON view of a user's files for scripts and internal tools. Listings are
+served with a weak ETag built from the user's listing version and the next
+time a file's status changes, so a poller revalidating an unchanged
+listing gets a 304 after a primary-key read and two index seeks, without
+running the listing query or serializing anything.
+
+Responses are encoded with orjson when it is installed (`pip install
+orjson`) and with the standard library otherwise.
+"""
+from flask import Blueprint, request, jsonify, Response
+from flask_login import login_required, current_user
+from models import File
+from config import DASHBOARD_PAGE_SIZE
+from listing import list_files, file_listing_query, file_json, next_user_status_change
+from usage import get_usage
+from events import broker, event_stream, usage_snapshot
+import json
+
+try:
+    import orjson
+
+    def dumps(payload):
+        return orjson.dumps(payload)
+except ImportError:
+    def dumps(payload):
+        return json.dumps(payload, separators=(',', ':'))
+
+api_bp = Blueprint('api', __name__, url_prefix='/api')
+
+# Largest page a client may ask for with ?limit=
+MAX_PAGE_SIZE = 500
+
+
+def listing_etag(*parts):
+    """
+    Weak ETag of a response built from the current user's files
+
+    The listing version is bumped with every upload, delete and expiry
+    sweep. Statuses also change as time passes, so the tag includes the
+    next time one of the user's files changes status; once that moment
+    passes the tag moves on to the following one. Together they change
+    whenever the response would.
+    """
+    version = get_usage(current_user.id).listing_version
+    status_change = next_user_status_change(current_user.id)
+    status_part = status_change.isoformat() if status_change else ''
+    return '-'.join(str(part) for part in (current_user.id, version, status_part) + parts)
+
+
+def json_response(payload, etag):
+    """JSON response carrying a weak ETag, revalidated on every use"""
+    response = Response(dumps(payload), mimetype='application/json')
+    response.set_etag(etag, weak=True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def not_modified(etag):
+    """304 response if the client's copy is still current, else None"""
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    response = Response(status=304)
+    response.set_etag(etag, weak=True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def file_page(search=None, prefix=False):
+    """Page of the user's files selected by ?after=, ?before= and ?limit=, optionally filtered by name"""
+    after = request.args.get('after')
+    before = request.args.get('before')
+    limit = request.args.get('limit', DASHBOARD_PAGE_SIZE, type=int)
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        return jsonify({'error': f'limit must be between 1 and {MAX_PAGE_SIZE}.'}), 400
+
+    etag = listing_etag('files', after or '', before or '', limit, search or '', 'prefix' if prefix else '')
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    try:
+        rows, prev_cursor, next_cursor = list_files(
+            current_user.id, after=after, before=before, limit=limit, search=search, prefix=prefix
+        )
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor.'}), 400
+
+    return json_response({
+        'files': [file_json(row) for row in rows],
+        'prev_cursor': prev_cursor,
+        'next_cursor': next_cursor
+    }, etag)
+
+
+@api_bp.route('/files')
+@login_required
+def api_list_files():
+    """One page of the user's files, newest first; follow next_cursor with ?after= and prev_cursor with ?before="""
+    return file_page()
+
+
+@api_bp.route('/files/search')
+@login_required
+def api_search_files():
+    """Files whose name contains ?q= (or starts with it, with ?match=prefix), paginated like /api/files"""
+    search = request.args.get('q', '').strip()
+    match = request.args.get('match', 'substring')
+    if not search:
+        return jsonify({'error': 'Please specify a search term.'}), 400
+    if match not in ('substring', 'prefix'):
+        return jsonify({'error': 'match must be substring or prefix.'}), 400
+    return file_page(search, prefix=match == 'prefix')
+
+
+@api_bp.route('/files/<int:file_id>')
+@login_required
+def api_get_file(file_id):
+    """A single file of the user's"""
+    etag = listing_etag('file', file_id)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    row = file_listing_query(current_user.id).filter(File.id == file_id).first()
+    if row is None:
+        return jsonify({'error': 'File not found.'}), 404
+
+    return json_response(file_json(row), etag)
+
+
+@api_bp.route('/events')
+@login_required
+def api_events():
+    """Server-Sent Events stream of changes to the user's files (see events.py)"""
+    if broker is None:
+        return jsonify({'error': 'Live updates are not enabled.'}), 404
+
+    # Subscribed before the version is read, so no change falls between the two
+    subscription = broker.subscribe(current_user.id)
+    version = usage_snapshot(current_user.id)['version']
+
+    response = Response(event_stream(subscription, version), mimetype='text/event-stream')
+    response.call_on_close(subscription.close)
+    response.cache_control.no_cache = True
+    response.headers['X-Accel-Buffering'] = 'no'  # Don't let nginx hold events back
+    return response
@@ -5,11 +5,15 @@ from config import (
     DATABASE_PATH, SECRET_KEY, UPLOAD_FOLDER,
     USE_RDS, DATABASE_URL, RDS_HOST, RDS_PORT,
     RDS_DB_NAME, RDS_USERNAME, RDS_PASSWORD,
-    USE_LAMBDA_SCHEDULER
+    USE_LAMBDA_SCHEDULER, USE_S3, ASYNC_S3_OFFLOAD
 )
 from auth import auth_bp
 from files import files_bp
+from api import api_bp
 from scheduler import start_scheduler, stop_scheduler
+from offload import resume_pending_offloads
+from usage import reconcile_usage
+from search import init_search_index
 import os
 import atexit
 from urllib.parse import quote_plus
@@ -54,6 +58,7 @@ login_manager.login_message_category = 'info'
 # Register blueprints
 app.register_blueprint(auth_bp)
 app.register_blueprint(files_bp)
+app.register_blueprint(api_bp)
 
 
 @login_manager.user_loader
@@ -77,6 +82,7 @@ def init_db():
         try:
             # Create database tables
             db.create_all()
+            init_search_index()
             db_type = "RDS (PostgreSQL)" if USE_RDS else "SQLite"
             print(f"[App] Database initialized ({db_type})")
         except Exception as e:
@@ -86,10 +92,22 @@ def init_db():
             raise
 
 
+@app.cli.command('reconcile-usage')
+def reconcile_usage_command():
+    """Rebuild per-user storage counters from the files table"""
+    drifted = reconcile_usage()
+    print(f"[Usage] Reconciled {drifted} user(s)")
+
+
 if __name__ == '__main__':
     # Initialize database
     init_db()
     
+    # Pick up spooled uploads that were not offloaded before the last shutdown
+    if USE_S3 and ASYNC_S3_OFFLOAD:
+        pending_count = resume_pending_offloads(app)
+        print(f"[App] Write-behind offload enabled ({pending_count} pending file(s) queued)")
+    
     # Start scheduler (only if Lambda scheduler is not enabled)
     if not USE_LAMBDA_SCHEDULER:
         start_scheduler(app)
@@ -0,0 +1,88 @@
+"""
+Streamed ZIP Export
+Builds a ZIP archive of several files while it is being sent. Members are
+read from storage one chunk at a time and compressed straight into the
+response, so nothing is staged on disk and memory stays constant however
+many files the archive holds.
+"""
+from config import USE_S3, COMPRESSIBLE_EXTENSIONS, DOWNLOAD_CHUNK_SIZE
+from s3_storage import stream_file_from_s3
+from streaming import decompress_chunks
+import zipfile
+
+
+class ZipStreamBuffer:
+    """
+    Write-only sink for ZipFile
+
+    It has no tell or seek, so ZipFile writes sizes and CRCs in data
+    descriptors after each member instead of seeking back to its header.
+    Bytes are held only until the generator drains them.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def member_chunks(file_record, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """Original bytes of a file, read from wherever it is stored and decompressed if needed"""
+    if USE_S3 and file_record.storage_state != 'pending':
+        success, result = stream_file_from_s3(file_record.filepath, chunk_size=chunk_size)
+        if not success:
+            raise IOError(f"{file_record.filename}: {result}")
+        chunks, _ = result
+    else:
+        chunks = _local_chunks(file_record.filepath, chunk_size)
+
+    if file_record.content_encoding:
+        chunks = decompress_chunks(chunks)
+    return chunks
+
+
+def _local_chunks(path, chunk_size):
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            yield chunk
+
+
+def stream_zip(file_records):
+    """
+    Generate a ZIP archive of the given files, member by member
+
+    Members are fetched in sequence. Types that are already compressed are
+    stored as they are; the rest are deflated.
+
+    Args:
+        file_records: File rows to include (names must be unique)
+
+    Yields:
+        bytes: Successive pieces of the archive
+    """
+    buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for file_record in file_records:
+            info = zipfile.ZipInfo(file_record.filename, date_time=file_record.upload_time.timetuple()[:6])
+            extension = file_record.filename.rsplit('.', 1)[-1].lower()
+            info.compress_type = zipfile.ZIP_DEFLATED if extension in COMPRESSIBLE_EXTENSIONS else zipfile.ZIP_STORED
+
+            force_zip64 = file_record.file_size >= zipfile.ZIP64_LIMIT
+            with archive.open(info, 'w', force_zip64=force_zip64) as member:
+                for chunk in member_chunks(file_record):
+                    member.write(chunk)
+                    data = buffer.drain()
+                    if data:
+                        yield data
+            yield buffer.drain()
+    yield buffer.drain()
@@ -0,0 +1,351 @@
+"""
+Blob Store
+Content-addressed storage shared by every File with identical bytes. Each
+blob is stored once under a key derived from its SHA-256 and reference
+counted, and the physical object is only removed when the last File
+pointing at it goes away.
+"""
+from models import db, Blob
+from config import (
+    USE_S3, UPLOAD_FOLDER, S3_BUCKET_PREFIX, UPLOAD_STREAM_CHUNK_SIZE, BATCH_UPLOAD_CONCURRENCY,
+    COMPRESS_UPLOADS, COMPRESSIBLE_EXTENSIONS
+)
+from s3_storage import upload_file_to_s3, delete_file_from_s3, move_object_in_s3
+from object_cache import invalidate_cached_object, object_version
+from streaming import CompressingUpload
+from sqlalchemy.exc import IntegrityError
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import shutil
+import tempfile
+import uuid
+
+# Compressed copies are only kept when they save at least this fraction of the size
+MIN_COMPRESSION_SAVING = 0.1
+
+
+def blob_storage_key(sha256):
+    """S3 key or local path a blob with the given digest is stored under"""
+    if USE_S3:
+        return f"{S3_BUCKET_PREFIX}/blobs/{sha256[:2]}/{sha256}"
+    return os.path.join(UPLOAD_FOLDER, 'blobs', sha256[:2], sha256)
+
+
+def staging_storage_key():
+    """Unique S3 key or local path for an upload whose digest isn't known yet"""
+    if USE_S3:
+        return f"{S3_BUCKET_PREFIX}/tmp/{uuid.uuid4().hex}"
+    staging_dir = os.path.join(UPLOAD_FOLDER, 'tmp')
+    os.makedirs(staging_dir, exist_ok=True)
+    return os.path.join(staging_dir, uuid.uuid4().hex)
+
+
+def hash_file(file_obj, chunk_size=UPLOAD_STREAM_CHUNK_SIZE):
+    """
+    Compute the SHA-256 and size of a seekable file
+
+    Returns:
+        tuple: (sha256: str, size: int)
+    """
+    digest = hashlib.sha256()
+    size = 0
+    file_obj.seek(0)
+    for chunk in iter(lambda: file_obj.read(chunk_size), b''):
+        digest.update(chunk)
+        size += len(chunk)
+    file_obj.seek(0)
+    return digest.hexdigest(), size
+
+
+def is_compressible(filename):
+    """Check whether files with this name are stored compressed"""
+    return (
+        COMPRESS_UPLOADS and '.' in filename
+        and filename.rsplit('.', 1)[1].lower() in COMPRESSIBLE_EXTENSIONS
+    )
+
+
+class _TempFileWriter:
+    """Minimal upload writer collecting compressed bytes in a spooled temporary file"""
+
+    def __init__(self):
+        self.file = tempfile.SpooledTemporaryFile(max_size=UPLOAD_STREAM_CHUNK_SIZE * 16)
+
+    def write(self, data):
+        self.file.write(data)
+
+    def complete(self):
+        return True, self.file
+
+    def abort(self):
+        self.file.close()
+
+
+def compress_file(file_obj, size):
+    """
+    gzip a seekable file if that saves enough space
+
+    Returns:
+        tuple: (file_obj, content_encoding) with the compressed copy and
+        'gzip', or the original file and None when compression doesn't pay
+    """
+    upload = CompressingUpload(_TempFileWriter())
+    file_obj.seek(0)
+    for chunk in iter(lambda: file_obj.read(UPLOAD_STREAM_CHUNK_SIZE), b''):
+        upload.write(chunk)
+    _, compressed = upload.complete()
+
+    if compressed.tell() > size * (1 - MIN_COMPRESSION_SAVING):
+        compressed.close()
+        file_obj.seek(0)
+        return file_obj, None
+
+    compressed.seek(0)
+    return compressed, 'gzip'
+
+
+def acquire_blob(sha256):
+    """
+    Take a new reference on an existing blob
+
+    Returns:
+        Blob or None: The blob with its refcount incremented, or None if no
+        blob with this digest exists yet
+    """
+    blob = Blob.query.filter_by(sha256=sha256).with_for_update().first()
+    if blob is not None:
+        blob.refcount = Blob.refcount + 1
+        db.session.flush()
+    return blob
+
+
+def _create_blob(sha256, storage_key, size, content_encoding=None):
+    """Insert a blob row, falling back to the existing one if another upload won the race"""
+    try:
+        with db.session.begin_nested():
+            blob = Blob(
+                sha256=sha256,
+                storage_key=storage_key,
+                size=size,
+                content_encoding=content_encoding,
+                refcount=1
+            )
+            db.session.add(blob)
+        return blob
+    except IntegrityError:
+        # Both uploads stored identical bytes under the same key, so just share it
+        return acquire_blob(sha256)
+
+
+def store_file(file_obj, compress=False):
+    """
+    Store a seekable file (e.g. a spooled upload) in the blob store
+
+    The file is hashed locally first, so bytes already in the store are
+    never uploaded again. With compress, new content is stored gzipped if
+    that makes it meaningfully smaller. The caller commits the session.
+
+    Returns:
+        tuple: (success: bool, Blob or error_message: str)
+    """
+    sha256, size = hash_file(file_obj)
+    blob = acquire_blob(sha256)
+    if blob is not None:
+        print(f"[Blobs] Reusing stored blob {sha256[:12]} (refs: {blob.refcount})")
+        return True, blob
+
+    storage_key = blob_storage_key(sha256)
+    success, result = _write_blob_object(file_obj, storage_key, sha256, size, compress)
+    if not success:
+        return False, result
+
+    return True, _create_blob(sha256, storage_key, size, content_encoding=result)
+
+
+def _write_blob_object(file_obj, storage_key, sha256, size, compress=False):
+    """
+    Write a file's bytes under a blob key (no database access, safe to run in a worker thread)
+
+    Uncompressed uploads to S3 are checked against sha256 as they are sent.
+
+    Returns:
+        tuple: (success: bool, content_encoding: str or None, or error_message: str)
+    """
+    content_encoding = None
+    try:
+        if compress:
+            file_obj, content_encoding = compress_file(file_obj, size)
+
+        if USE_S3:
+            success, result = upload_file_to_s3(
+                file_obj, None, None,
+                s3_key=storage_key,
+                content_encoding=content_encoding,
+                expected_sha256=None if content_encoding else sha256
+            )
+            return (True, content_encoding) if success else (False, result)
+
+        os.makedirs(os.path.dirname(storage_key), exist_ok=True)
+        temp_path = f"{storage_key}.{uuid.uuid4().hex}.part"
+        file_obj.seek(0)
+        with open(temp_path, 'wb') as f:
+            shutil.copyfileobj(file_obj, f)
+        os.replace(temp_path, storage_key)
+        return True, content_encoding
+    except Exception as e:
+        return False, f"Upload error: {str(e)}"
+    finally:
+        if content_encoding:
+            # Only the temporary compressed copy is ours to close
+            file_obj.close()
+
+
+def store_files(file_objs, compress=None, max_workers=BATCH_UPLOAD_CONCURRENCY):
+    """
+    Store several seekable files in the blob store at once
+
+    compress optionally lists, per file, whether it may be stored
+    compressed (see store_file).
+
+    Every file is hashed first and the stored digests are looked up in one
+    query. Content not stored yet is written once per distinct digest by a
+    bounded pool of worker threads; blob rows are then created or referenced
+    on the calling thread, since the database session isn't shared with the
+    workers. The caller commits the session.
+
+    Returns:
+        list: (success: bool, Blob or error_message: str) for each file, in order
+    """
+    compress = compress or [False] * len(file_objs)
+    digests = [hash_file(file_obj) for file_obj in file_objs]
+    stored = {
+        sha256 for (sha256,) in db.session.query(Blob.sha256).filter(
+            Blob.sha256.in_({sha256 for sha256, _ in digests})
+        )
+    }
+
+    pending = {}
+    for file_obj, (sha256, size), should_compress in zip(file_objs, digests, compress):
+        if sha256 not in stored and sha256 not in pending:
+            pending[sha256] = (file_obj, size, should_compress)
+
+    written = {}
+    if pending:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(pending))) as executor:
+            futures = {
+                sha256: executor.submit(
+                    _write_blob_object, file_obj, blob_storage_key(sha256), sha256, size, should_compress
+                )
+                for sha256, (file_obj, size, should_compress) in pending.items()
+            }
+        written = {sha256: future.result() for sha256, future in futures.items()}
+
+    results = []
+    for file_obj, (sha256, size), should_compress in zip(file_objs, digests, compress):
+        if sha256 in written:
+            success, result = written[sha256]
+            if not success:
+                results.append((False, result))
+                continue
+            blob = acquire_blob(sha256) or _create_blob(sha256, blob_storage_key(sha256), size, content_encoding=result)
+            results.append((True, blob))
+        else:
+            # Already stored; if the blob vanished since the lookup, store it again
+            results.append(store_file(file_obj, compress=should_compress))
+    return results
+
+
+def store_staged_file(staged_key, sha256, size, content_encoding=None):
+    """
+    Move a fully written staging object into the blob store
+
+    Used for uploads that were hashed while streaming to a staging key;
+    sha256 and size describe the original bytes, content_encoding how the
+    staged copy is encoded. If the content is already stored, the staged
+    copy is simply discarded. The caller commits the session.
+
+    Returns:
+        tuple: (success: bool, Blob or error_message: str)
+    """
+    blob = acquire_blob(sha256)
+    if blob is not None:
+        discard_staged_file(staged_key)
+        print(f"[Blobs] Reusing stored blob {sha256[:12]} (refs: {blob.refcount})")
+        return True, blob
+
+    storage_key = blob_storage_key(sha256)
+    if USE_S3:
+        success, result = move_object_in_s3(staged_key, storage_key)
+        if not success:
+            discard_staged_file(staged_key)
+            return False, result
+    else:
+        os.makedirs(os.path.dirname(storage_key), exist_ok=True)
+        os.replace(staged_key, storage_key)
+
+    return True, _create_blob(sha256, storage_key, size, content_encoding=content_encoding)
+
+
+def discard_staged_file(staged_key):
+    """Remove a staging object that won't be kept"""
+    if USE_S3:
+        delete_file_from_s3(None, None, s3_key=staged_key)
+    elif os.path.exists(staged_key):
+        os.remove(staged_key)
+
+
+def release_blob(blob):
+    """
+    Drop one reference to a blob, deleting the stored object with the last one
+
+    Returns:
+        tuple: (success: bool, message: str)
+    """
+    blob = Blob.query.filter_by(id=blob.id).with_for_update().one()
+    blob.refcount = Blob.refcount - 1
+    db.session.flush()
+    db.session.refresh(blob)
+    if blob.refcount > 0:
+        return True, f"Blob still referenced by {blob.refcount} file(s)"
+
+    if USE_S3:
+        success, message = delete_file_from_s3(None, None, s3_key=blob.storage_key)
+        if not success:
+            return False, message
+        invalidate_cached_object(blob.storage_key, object_version(blob.id, blob.content_encoding))
+    elif os.path.exists(blob.storage_key):
+        os.remove(blob.storage_key)
+
+    db.session.delete(blob)
+    print(f"[Blobs] Deleted blob {blob.sha256[:12]}")
+    return True, "Blob deleted"
+
+
+def delete_stored_file(file_record):
+    """
+    Release the storage behind a File row (caller deletes the row and commits)
+
+    Files in the blob store release their reference; older files stored
+    directly under their own key and files still waiting in the offload
+    spool are deleted outright.
+
+    Returns:
+        tuple: (success: bool, message: str)
+    """
+    if file_record.blob_id is not None:
+        return release_blob(file_record.blob)
+
+    if file_record.storage_state == 'pending':
+        # Not offloaded yet, only the local spool file exists
+        if os.path.exists(file_record.filepath):
+            os.remove(file_record.filepath)
+        return True, "File deleted successfully"
+
+    if USE_S3:
+        invalidate_cached_object(file_record.filepath, object_version(file_id=file_record.id))
+        return delete_file_from_s3(file_record.user_id, file_record.filename, s3_key=file_record.filepath)
+
+    if os.path.exists(file_record.filepath):
+        os.remove(file_record.filepath)
+    return True, "File deleted successfully"
@@ -22,9 +22,45 @@ DATABASE_PATH = os.path.join(BASE_DIR, '')
 
 # Upload settings
 UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
-MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB
+MAX_FILE_SIZE = int(os.environ.get('MAX_FILE_SIZE_MB') or 16) * 1024 * 1024  # 16MB by default
+UPLOAD_FORM_OVERHEAD = 64 * 1024  # Allowance for multipart boundaries and form fields around a file
+USER_QUOTA = int(os.environ.get('USER_QUOTA_MB') or 0) * 1024 * 1024  # Per-user storage quota (0 = unlimited)
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'doc', 'docx', 'xls', 'xlsx', 'zip'}
 
+# Transparent compression (eligible files are stored gzip-encoded)
+COMPRESS_UPLOADS = os.environ.get('COMPRESS_UPLOADS', 'true').lower() == 'true'
+COMPRESSIBLE_EXTENSIONS = {'txt', 'doc', 'xls'}  # The other allowed types are already compressed
+COMPRESSION_LEVEL = 6
+
+# Streaming uploads (parse the request body incrementally instead of spooling it)
+STREAMING_UPLOADS = os.environ.get('STREAMING_UPLOADS', 'false').lower() == 'true'
+UPLOAD_STREAM_CHUNK_SIZE = 64 * 1024  # Bytes read from the request body at a time
+
+# Batch uploads (many files in one request, stored in parallel and committed together)
+BATCH_UPLOAD_MAX_FILES = int(os.environ.get('BATCH_UPLOAD_MAX_FILES') or 50)
+BATCH_UPLOAD_CONCURRENCY = max(int(os.environ.get('BATCH_UPLOAD_CONCURRENCY') or 4), 1)  # Files stored at the same time
+
+# Resumable chunked uploads (chunks map onto S3 multipart parts, so at least 5MB)
+RESUMABLE_CHUNK_SIZE = max(int(os.environ.get('RESUMABLE_CHUNK_SIZE_MB') or 8), 5) * 1024 * 1024
+RESUMABLE_SESSION_TTL_HOURS = int(os.environ.get('RESUMABLE_SESSION_TTL_HOURS') or 24)  # Abandoned sessions are cleaned up after this
+
+# Dashboard (files are listed a page at a time, newest first)
+DASHBOARD_PAGE_SIZE = int(os.environ.get('DASHBOARD_PAGE_SIZE') or 50)
+
+# Rendered file tables are cached per user and listing version: 'memory' (per process),
+# 'redis' (shared by all workers, needs the redis package and REDIS_URL) or 'none'
+DASHBOARD_CACHE_BACKEND = os.environ.get('DASHBOARD_CACHE_BACKEND', 'memory').lower()
+DASHBOARD_CACHE_MAX_ENTRIES = int(os.environ.get('DASHBOARD_CACHE_MAX_ENTRIES') or 1024)  # Memory backend only
+DASHBOARD_CACHE_TTL_SECONDS = int(os.environ.get('DASHBOARD_CACHE_TTL_SECONDS') or 300)
+REDIS_URL = os.environ.get('REDIS_URL') or 'redis://localhost:6379/0'
+
+# Push file changes to open dashboards over Server-Sent Events. Each open
+# dashboard holds a connection, so run threaded or async workers.
+# EVENTS_BACKEND: 'memory' (clients of the same process) or 'redis' (all workers)
+LIVE_UPDATES = os.environ.get('LIVE_UPDATES', 'false').lower() == 'true'
+EVENTS_BACKEND = os.environ.get('EVENTS_BACKEND', 'memory').lower()
+EVENT_STREAM_MAX_SECONDS = int(os.environ.get('EVENT_STREAM_MAX_SECONDS') or 300)  # Clients reconnect after this
+
 # Session settings
 SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
 SESSION_COOKIE_SECURE = False  # Set to True in production with HTTPS
@@ -52,3 +88,40 @@ AWS_SECRET_ACCESS_KEY = os.environ.get('AWS_SECRET_ACCESS_KEY') or ''
 AWS_REGION = os.environ.get('AWS_REGION') or ''
 S3_BUCKET_NAME = os.environ.get('S3_BUCKET_NAME') or ''
 S3_BUCKET_PREFIX = os.environ.get('S3_BUCKET_PREFIX') or ''  # Folder prefix in bucket
+# Part size for streamed multipart uploads (S3 requires at least 5MB per part)
+S3_MULTIPART_PART_SIZE = max(int(os.environ.get('S3_MULTIPART_PART_SIZE_MB') or 8), 5) * 1024 * 1024
+
+# Managed transfers (upload_fileobj/download_fileobj)
+S3_MULTIPART_THRESHOLD = int(os.environ.get('S3_MULTIPART_THRESHOLD_MB') or 16) * 1024 * 1024  # Smaller files use one request
+S3_MAX_CONCURRENCY = max(int(os.environ.get('S3_MAX_CONCURRENCY') or 10), 1)  # Parallel part transfers per file
+S3_MAX_POOL_CONNECTIONS = int(os.environ.get('S3_MAX_POOL_CONNECTIONS') or S3_MAX_CONCURRENCY * 2)  # Shared by all requests
+S3_USE_CRT = os.environ.get('S3_USE_CRT', 'false').lower() == 'true'  # Needs boto3[crt]; only used on optimized instances
+
+# Downloads proxied from S3 are streamed in chunks of this size
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Let the front proxy send local files after the ownership check:
+# 'nginx' (X-Accel-Redirect), 'sendfile' (X-Sendfile, Apache/lighttpd) or empty to send from Flask
+PROXY_SENDFILE = os.environ.get('PROXY_SENDFILE', '').lower()
+PROXY_SENDFILE_PREFIX = os.environ.get('PROXY_SENDFILE_PREFIX') or '/protected-uploads'  # nginx internal location aliased to UPLOAD_FOLDER
+
+# Multi-file ZIP downloads (streamed while the archive is built)
+ZIP_EXPORT_MAX_FILES = int(os.environ.get('ZIP_EXPORT_MAX_FILES') or 500)
+
+# Local disk cache of S3 objects for repeat downloads (disabled when no directory is set)
+S3_CACHE_DIR = os.environ.get('S3_CACHE_DIR') or ''
+S3_CACHE_MAX_BYTES = int(os.environ.get('S3_CACHE_MAX_MB') or 1024) * 1024 * 1024  # Disk budget shared by all processes using S3_CACHE_DIR
+S3_CACHE_PROCESSES = max(int(os.environ.get('S3_CACHE_PROCESSES') or 1), 1)  # Worker processes the budget is split between
+
+# Direct browser-to-S3 uploads via presigned POST (bucket needs a CORS rule allowing POST)
+DIRECT_UPLOADS = os.environ.get('DIRECT_UPLOADS', 'false').lower() == 'true'
+PRESIGNED_POST_EXPIRY_SECONDS = int(os.environ.get('PRESIGNED_POST_EXPIRY_SECONDS') or 600)
+
+# Redirect downloads to short-lived presigned GET URLs instead of proxying the bytes
+PRESIGNED_DOWNLOADS = os.environ.get('PRESIGNED_DOWNLOADS', 'false').lower() == 'true'
+PRESIGNED_GET_EXPIRY_SECONDS = int(os.environ.get('PRESIGNED_GET_EXPIRY_SECONDS') or 300)
+PRESIGNED_GET_CACHE_FRACTION = 0.5  # Signed URLs are reused for this share of their lifetime
+
+# Write-behind offload: uploads are spooled locally and pushed to S3 in the background
+ASYNC_S3_OFFLOAD = os.environ.get('ASYNC_S3_OFFLOAD', 'false').lower() == 'true'
+OFFLOAD_WORKERS = max(int(os.environ.get('OFFLOAD_WORKERS') or 4), 1)  # Background upload threads
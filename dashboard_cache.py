@@ -0,0 +1,102 @@
+"""
+Dashboard Cache
+Rendered file tables cached per user under the user's listing version.
+Uploads, deletes, expiry sweeps and offloads bump the version in the same
+transaction as the change, so stale entries are never looked up again and
+simply age out; repeat views skip both the listing query and rendering.
+
+Backends are pluggable: an in-process LRU for single-node deployments, or
+Redis shared by every worker.
+"""
+from config import (
+    DASHBOARD_CACHE_BACKEND,
+    DASHBOARD_CACHE_MAX_ENTRIES,
+    DASHBOARD_CACHE_TTL_SECONDS,
+    REDIS_URL
+)
+from collections import OrderedDict
+import threading
+import time
+
+
+class MemoryCache:
+    """In-process LRU cache with per-entry expiry"""
+
+    def __init__(self, max_entries=DASHBOARD_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # Key -> (value, expires_at), least recently used first
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (value, time.time() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class RedisCache:
+    """Cache shared by every worker process, stored in Redis"""
+
+    def __init__(self, url=REDIS_URL):
+        import redis
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        try:
+            value = self.client.get(key)
+        except Exception as e:
+            print(f"[Cache] Redis get failed: {str(e)}")
+            return None
+        return value.decode() if value is not None else None
+
+    def set(self, key, value, ttl):
+        try:
+            self.client.set(key, value, ex=max(int(ttl), 1))
+        except Exception as e:
+            print(f"[Cache] Redis set failed: {str(e)}")
+
+
+def create_dashboard_cache():
+    """
+    Build the backend selected by DASHBOARD_CACHE_BACKEND
+
+    Returns:
+        MemoryCache, RedisCache or None when caching is disabled
+    """
+    if DASHBOARD_CACHE_BACKEND == 'none':
+        return None
+    if DASHBOARD_CACHE_BACKEND == 'redis':
+        try:
+            return RedisCache()
+        except ImportError:
+            print("[Cache] redis package not installed, falling back to in-process dashboard cache")
+    return MemoryCache()
+
+
+dashboard_cache = create_dashboard_cache()
+
+
+def dashboard_cache_key(user_id, listing_version, after=None, before=None, search=None):
+    """Key of one rendered page of a user's files (search goes last, as it may contain colons)"""
+    return f"dashboard:{user_id}:{listing_version}:{after or ''}:{before or ''}:{search or ''}"
+
+
+def cache_ttl(valid_until=None):
+    """Seconds an entry may live: DASHBOARD_CACHE_TTL_SECONDS, or less if its content goes stale sooner"""
+    ttl = DASHBOARD_CACHE_TTL_SECONDS
+    if valid_until is not None:
+        ttl = min(ttl, valid_until)
+    return max(ttl, 0)
@@ -0,0 +1,202 @@
+"""
+Live Events
+Per-user change events (file added, updated, removed, expiring, expired)
+pushed to open dashboards over Server-Sent Events, so the page patches its
+table in place instead of reloading. Events are queued on the database
+session and published only once its transaction commits, so clients never
+hear about a change that was rolled back.
+
+The memory broker reaches clients connected to the same process; the Redis
+broker fans events out to every worker. Deletions made by the Lambda sweep
+happen outside the app and show up the next time the page loads.
+"""
+from models import db, UserUsage
+from listing import expiring_count
+from config import LIVE_UPDATES, EVENTS_BACKEND, EVENT_STREAM_MAX_SECONDS, REDIS_URL
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import json
+import queue
+import threading
+import time
+
+# Comment sent when nothing happened for this long, so proxies keep the connection open
+KEEPALIVE_SECONDS = 15
+
+# Events buffered per client before it is told to reload instead
+MAX_PENDING_EVENTS = 100
+
+PENDING_EVENTS_KEY = 'pending_events'
+
+
+def format_event(name, data):
+    """One Server-Sent Events message"""
+    return f"event: {name}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+class MemorySubscription:
+    """Events for one connected client of this process"""
+
+    def __init__(self, broker, user_id):
+        self.broker = broker
+        self.user_id = user_id
+        self.messages = queue.Queue(maxsize=MAX_PENDING_EVENTS)
+        self.overflowed = False
+
+    def get(self, timeout):
+        """Next message, or None if none arrived within timeout seconds"""
+        if self.overflowed:
+            self.overflowed = False
+            return format_event('resync', {})
+        try:
+            return self.messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class MemoryBroker:
+    """Delivers events to clients connected to this process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = {}  # User ID -> set of MemorySubscription
+
+    def subscribe(self, user_id):
+        subscription = MemorySubscription(self, user_id)
+        with self.lock:
+            self.subscriptions.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.user_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self.subscriptions.pop(subscription.user_id, None)
+
+    def publish(self, user_id, message):
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.messages.put_nowait(message)
+            except queue.Full:
+                # Too far behind to patch the page; it reloads instead
+                subscription.overflowed = True
+
+
+class RedisSubscription:
+    """Events for one connected client, read from the user's Redis channel"""
+
+    def __init__(self, pubsub):
+        self.pubsub = pubsub
+
+    def get(self, timeout):
+        """Next message, or None if none arrived within timeout seconds"""
+        message = self.pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+        return message['data'].decode() if message else None
+
+    def close(self):
+        self.pubsub.close()
+
+
+class RedisBroker:
+    """Delivers events to clients of every worker through Redis pub/sub"""
+
+    def __init__(self, url=REDIS_URL):
+        import redis
+        self.client = redis.Redis.from_url(url)
+
+    def subscribe(self, user_id):
+        pubsub = self.client.pubsub()
+        pubsub.subscribe(f"events:{user_id}")
+        return RedisSubscription(pubsub)
+
+    def publish(self, user_id, message):
+        self.client.publish(f"events:{user_id}", message)
+
+
+def create_broker():
+    """
+    Build the broker selected by EVENTS_BACKEND
+
+    Returns:
+        MemoryBroker, RedisBroker or None when live updates are disabled
+    """
+    if not LIVE_UPDATES:
+        return None
+    if EVENTS_BACKEND == 'redis':
+        try:
+            return RedisBroker()
+        except ImportError:
+            print("[Events] redis package not installed, falling back to in-process events")
+    return MemoryBroker()
+
+
+broker = create_broker()
+
+
+def usage_snapshot(user_id):
+    """A user's counters and listing version as they stand in the current transaction"""
+    row = db.session.query(
+        UserUsage.total_bytes, UserUsage.file_count, UserUsage.listing_version
+    ).filter(UserUsage.user_id == user_id).first()
+    if row is None:
+        return {'total_bytes': 0, 'file_count': 0, 'expiring_count': 0, 'version': 0}
+    return {
+        'total_bytes': row.total_bytes,
+        'file_count': row.file_count,
+        'expiring_count': expiring_count(user_id),
+        'version': row.listing_version
+    }
+
+
+def queue_event(user_id, name, data):
+    """
+    Publish an event to a user's open dashboards when the current transaction commits
+
+    Call it after the change and its usage adjustment, so the event carries
+    the counters and listing version the change leaves behind.
+    """
+    if broker is None:
+        return
+    message = format_event(name, dict(data, usage=usage_snapshot(user_id)))
+    db.session.info.setdefault(PENDING_EVENTS_KEY, []).append((user_id, message))
+
+
+@event.listens_for(Session, 'after_commit')
+def publish_queued_events(session):
+    for user_id, message in session.info.pop(PENDING_EVENTS_KEY, []):
+        try:
+            broker.publish(user_id, message)
+        except Exception as e:
+            print(f"[Events] Failed to publish event for user {user_id}: {str(e)}")
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def discard_queued_events(session, previous_transaction):
+    # A rolled back savepoint keeps the events queued after it was released
+    if not previous_transaction.nested:
+        session.info.pop(PENDING_EVENTS_KEY, None)
+
+
+def event_stream(subscription, version):
+    """
+    Generate a client's event stream
+
+    Starts with a hello carrying the listing version, so a client that
+    missed events while disconnected can tell and reload. Ends after
+    EVENT_STREAM_MAX_SECONDS; the browser then reconnects.
+    """
+    yield 'retry: 5000\n\n'
+    yield format_event('hello', {'version': version})
+    deadline = time.monotonic() + EVENT_STREAM_MAX_SECONDS
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        message = subscription.get(timeout=min(KEEPALIVE_SECONDS, remaining))
+        yield message if message is not None else ': keepalive\n\n'
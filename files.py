@@ -1,72 +1,232 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file, abort, jsonify
+from flask import (
+    Blueprint, render_template, request, redirect, url_for, flash, send_file, abort, jsonify,
+    current_app, make_response, Response, stream_with_context
+)
 from flask_login import login_required, current_user
-from models import db, File
-from config import UPLOAD_FOLDER, MAX_FILE_SIZE, ALLOWED_EXTENSIONS, USE_S3
+from models import db, File, UploadSession
+from config import (
+    UPLOAD_FOLDER, MAX_FILE_SIZE, ALLOWED_EXTENSIONS, USE_S3, STREAMING_UPLOADS,
+    DIRECT_UPLOADS, PRESIGNED_POST_EXPIRY_SECONDS, SECRET_KEY, BATCH_UPLOAD_MAX_FILES,
+    ASYNC_S3_OFFLOAD, UPLOAD_FORM_OVERHEAD, RESUMABLE_CHUNK_SIZE,
+    PRESIGNED_DOWNLOADS, PRESIGNED_GET_EXPIRY_SECONDS, ZIP_EXPORT_MAX_FILES,
+    PROXY_SENDFILE, PROXY_SENDFILE_PREFIX, LIVE_UPDATES
+)
 from werkzeug.utils import secure_filename
-from datetime import datetime, timedelta
+from markupsafe import Markup
+from urllib.parse import quote
+from werkzeug.exceptions import RequestEntityTooLarge
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta, timezone
 from scheduler import process_expired_files
 from s3_storage import (
-    upload_file_to_s3,
-    download_file_from_s3,
+    stream_file_from_s3,
     delete_file_from_s3,
-    ensure_unique_filename_in_s3,
-    file_exists_in_s3
+    new_object_key,
+    generate_presigned_upload,
+    generate_presigned_download,
+    head_object_in_s3,
+    S3MultipartUpload
+)
+import mimetypes
+from streaming import (
+    stream_multipart_upload, LocalFileUpload, HashingUpload, CompressingUpload, UploadRejected,
+    decompress_chunks
 )
+from resumable import create_upload_session, store_chunk, finish_upload_session, discard_upload_session
+from blobs import (
+    store_file, store_files, store_staged_file, discard_staged_file, staging_storage_key,
+    delete_stored_file, release_blob, is_compressible
+)
+from offload import spool_path, enqueue_offload
+from admission import admit_upload, quota_exceeded, enforce_quota, QuotaExceeded, wants_json
+from object_cache import cached_object_path, object_version
+from archive import stream_zip
+from search import escape_like
+from listing import list_files, next_status_change, file_status, file_json, expiring_count
+from dashboard_cache import dashboard_cache, dashboard_cache_key, cache_ttl
+from usage import file_added, file_removed, get_usage
+from events import queue_event
+from ranges import requested_ranges, range_response, range_not_satisfiable, file_range_reader, s3_range_reader
+import gzip
 import os
 
 files_bp = Blueprint('files', __name__)
 
+# Write-behind mode: uploads land in a local spool and a worker pool pushes them to S3
+OFFLOAD_UPLOADS = USE_S3 and ASYNC_S3_OFFLOAD
+
+# Signs the upload details handed to the browser for direct-to-S3 uploads
+direct_upload_serializer = URLSafeTimedSerializer(SECRET_KEY, salt='direct-upload')
+
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def allocate_filename(user_id, filename):
+    """
+    Pick the first free display name among filename, name_1, name_2, ...
+    
+    All names already taken are fetched in one query on the
+    (user_id, filename) unique index instead of probing each candidate.
+    """
+    base_name, ext = os.path.splitext(filename)
+    
+    taken = {
+        name for (name,) in db.session.query(File.filename).filter(
+            File.user_id == user_id,
+            or_(
+                File.filename == filename,
+                File.filename.like(f"{escape_like(base_name)}\\_%{escape_like(ext)}", escape='\\')
+            )
+        )
+    }
+    
+    candidate = filename
+    counter = 1
+    while candidate in taken:
+        candidate = f"{base_name}_{counter}{ext}"
+        counter += 1
+    
+    return candidate
+
+
+def add_file_with_unique_name(new_file, attempts=5):
+    """
+    Add a File row under a free display name (caller commits)
+    
+    The unique constraint on (user_id, filename) catches concurrent uploads
+    that picked the same name; the insert is then retried with a new one.
+    Raises QuotaExceeded, with only the row itself rolled back, if the file
+    takes the user over their quota.
+    """
+    requested_name = new_file.filename
+    for _ in range(attempts):
+        new_file.filename = allocate_filename(new_file.user_id, requested_name)
+        try:
+            with db.session.begin_nested():
+                db.session.add(new_file)
+                file_added(new_file)
+                enforce_quota(new_file.user_id)
+            queue_event(new_file.user_id, 'file_added', {'file': file_json(new_file, file_status(new_file.expiry_time))})
+            return new_file
+        except IntegrityError:
+            continue
+    
+    raise RuntimeError(f'Could not allocate a unique name for "{requested_name}"')
+
+
+def release_rejected_blob(blob):
+    """Give back the blob of an upload refused at insert time, deleting it if nothing else uses it"""
+    try:
+        release_blob(blob)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"[Upload] Could not release blob {blob.sha256[:12]}: {str(e)}")
+
+
+def upload_succeeded(new_file, message):
+    """Reply to a single-file upload: the new file as JSON for the live dashboard, else a flash and redirect"""
+    if wants_json():
+        return jsonify({'id': new_file.id, 'filename': new_file.filename, 'file_size': new_file.file_size})
+    flash(message, 'success')
+    return redirect(url_for('files.dashboard'))
+
+
+def upload_failed(message, status=400):
+    """Reject a single-file upload: a JSON error for the live dashboard, else a flash and redirect"""
+    if wants_json():
+        return jsonify({'error': message}), status
+    flash(message, 'error')
+    return redirect(url_for('files.dashboard'))
+
+
+@files_bp.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    """Body cut off by the admission limit while it was being read"""
+    message = 'Upload exceeds maximum allowed size.'
+    if request.endpoint == 'files.upload_file':
+        return upload_failed(message, 413)
+    return jsonify({'error': message}), 413
+
+
 @files_bp.route('/')
 @files_bp.route('/dashboard')
 @login_required
 def dashboard():
     """Display user's files"""
-    user_files = File.query.filter_by(user_id=current_user.id).order_by(File.upload_time.desc()).all()
+    after = request.args.get('after')
+    before = request.args.get('before')
+    search = request.args.get('q', '').strip() or None
+    usage = get_usage(current_user.id)
     
-    # Add status information
-    files_data = []
-    for file in user_files:
-        files_data.append({
-            'id': file.id,
-            'filename': file.filename,
-            'upload_time': file.upload_time,
-            'expiry_time': file.expiry_time,
-            'file_size': file.file_size,
-            'is_expired': file.is_expired(),
-            'hours_until_expiry': file.hours_until_expiry() if not file.is_expired() else 0
-        })
+    # The table only changes when the listing version does (or a file's status ticks over)
+    cache_key = dashboard_cache_key(current_user.id, usage.listing_version, after, before, search)
+    files_table = dashboard_cache.get(cache_key) if dashboard_cache else None
+    if files_table is None:
+        try:
+            files_page, prev_cursor, next_cursor = list_files(
+                current_user.id, after=after, before=before, search=search
+            )
+        except ValueError:
+            return redirect(url_for('files.dashboard', q=search))
+        
+        if not files_page and (after or before):
+            # Paged past the end (files were deleted meanwhile)
+            return redirect(url_for('files.dashboard', q=search))
+        
+        files_table = render_template(
+            'files_table.html',
+            files=files_page,
+            prev_cursor=prev_cursor,
+            next_cursor=next_cursor,
+            search=search
+        )
+        if dashboard_cache:
+            status_change = next_status_change(files_page)
+            valid_until = (status_change - datetime.utcnow()).total_seconds() if status_change else None
+            ttl = cache_ttl(valid_until)
+            if ttl >= 1:
+                dashboard_cache.set(cache_key, files_table, ttl)
     
-    return render_template('dashboard.html', files=files_data)
+    return render_template(
+        'dashboard.html',
+        files_table=Markup(files_table),
+        search=search,
+        usage=usage,
+        expiring_count=expiring_count(current_user.id),
+        live_updates=LIVE_UPDATES,
+        max_file_size=MAX_FILE_SIZE,
+        direct_uploads=DIRECT_UPLOADS and USE_S3
+    )
 
 
 @files_bp.route('/upload', methods=['POST'])
 @login_required
+@admit_upload(MAX_FILE_SIZE + UPLOAD_FORM_OVERHEAD)
 def upload_file():
     """Handle file upload"""
+    if STREAMING_UPLOADS:
+        return upload_file_streaming()
+    
     if 'file' not in request.files:
-        flash('No file selected.', 'error')
-        return redirect(url_for('files.dashboard'))
+        return upload_failed('No file selected.')
     
     file = request.files['file']
     expiry_days = request.form.get('expiry_days', type=int)
     
     if file.filename == '':
-        flash('No file selected.', 'error')
-        return redirect(url_for('files.dashboard'))
+        return upload_failed('No file selected.')
     
     if not expiry_days or expiry_days < 1:
-        flash('Please specify a valid expiry time (at least 1 day).', 'error')
-        return redirect(url_for('files.dashboard'))
+        return upload_failed('Please specify a valid expiry time (at least 1 day).')
     
     if not allowed_file(file.filename):
-        flash('File type not allowed.', 'error')
-        return redirect(url_for('files.dashboard'))
+        return upload_failed('File type not allowed.')
     
     # Check file size
     file.seek(0, os.SEEK_END)
@@ -74,65 +234,697 @@ def upload_file():
     file.seek(0)
     
     if file_size > MAX_FILE_SIZE:
-        flash(f'File size exceeds maximum allowed size ({MAX_FILE_SIZE // (1024*1024)}MB).', 'error')
-        return redirect(url_for('files.dashboard'))
+        return upload_failed(f'File size exceeds maximum allowed size ({MAX_FILE_SIZE // (1024*1024)}MB).', 413)
+    
+    if OFFLOAD_UPLOADS:
+        return spool_upload(file, file.filename, file_size, expiry_days)
     
     try:
-        # Secure filename
+        # Secure filename (made unique among the user's files when the row is added)
         filename = secure_filename(file.filename)
         
-        if USE_S3:
-            # Use S3 storage
-            # Ensure unique filename in S3
-            filename = ensure_unique_filename_in_s3(current_user.id, filename)
-            
-            # Upload to S3
-            success, result = upload_file_to_s3(file, current_user.id, filename)
-            if not success:
-                flash(f'Upload failed: {result}', 'error')
-                return redirect(url_for('files.dashboard'))
-            
-            s3_key = result  # result is the S3 key
-            filepath = s3_key  # Store S3 key as filepath
-        else:
-            # Use local storage (fallback)
-            user_dir = os.path.join(UPLOAD_FOLDER, f'user_{current_user.id}')
-            os.makedirs(user_dir, exist_ok=True)
-            
-            # Ensure unique filename
-            base_name, ext = os.path.splitext(filename)
-            counter = 1
-            filepath = os.path.join(user_dir, filename)
-            
-            while os.path.exists(filepath):
-                filename = f"{base_name}_{counter}{ext}"
-                filepath = os.path.join(user_dir, filename)
-                counter += 1
-            
-            # Save file locally
-            file.save(filepath)
+        # Store content in the blob store (S3 or local); identical bytes are stored once
+        success, result = store_file(file, compress=is_compressible(filename))
+        if not success:
+            return upload_failed(f'Upload failed: {result}', 502)
+        
+        blob = result
         
         # Calculate expiry time
         expiry_time = datetime.utcnow() + timedelta(days=expiry_days)
         
         # Save to database
-        new_file = File(
+        new_file = File.from_blob(
+            blob,
             user_id=current_user.id,
             filename=filename,
-            filepath=filepath,  # S3 key or local path
             file_size=file_size,
             expiry_time=expiry_time
         )
-        db.session.add(new_file)
+        add_file_with_unique_name(new_file)
         db.session.commit()
         
         storage_type = "S3" if USE_S3 else "local"
-        flash(f'File "{filename}" uploaded successfully to {storage_type}!', 'success')
+        return upload_succeeded(new_file, f'File "{new_file.filename}" uploaded successfully to {storage_type}!')
+    except QuotaExceeded as e:
+        release_rejected_blob(blob)
+        return upload_failed(str(e), 413)
     except Exception as e:
         db.session.rollback()
-        flash(f'Upload failed: {str(e)}', 'error')
+        return upload_failed(f'Upload failed: {str(e)}', 500)
+
+
+def spool_upload(file, original_filename, file_size, expiry_days, spooled_path=None):
+    """
+    Record an upload as pending and queue it for offload to S3
     
-    return redirect(url_for('files.dashboard'))
+    The file is saved to the local spool unless it was already streamed
+    there (spooled_path), so the request never waits on S3.
+    """
+    try:
+        if spooled_path is None:
+            spooled_path = spool_path()
+            file.save(spooled_path)
+        
+        new_file = File(
+            user_id=current_user.id,
+            filename=secure_filename(original_filename),
+            filepath=spooled_path,  # Replaced by the blob key once offloaded
+            file_size=file_size,
+            expiry_time=datetime.utcnow() + timedelta(days=expiry_days),
+            storage_state='pending'
+        )
+        add_file_with_unique_name(new_file)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        if spooled_path and os.path.exists(spooled_path):
+            os.remove(spooled_path)
+        if isinstance(e, QuotaExceeded):
+            return upload_failed(str(e), 413)
+        return upload_failed(f'Upload failed: {str(e)}', 500)
+    
+    enqueue_offload(current_app._get_current_object(), new_file.id)
+    return upload_succeeded(new_file, f'File "{new_file.filename}" uploaded successfully and is being transferred to S3!')
+
+
+def upload_file_streaming():
+    """Handle file upload by streaming the request body straight to storage"""
+    def parse_expiry_days(value):
+        try:
+            expiry_days = int(value)
+        except (TypeError, ValueError):
+            expiry_days = 0
+        if expiry_days < 1:
+            raise UploadRejected('Please specify a valid expiry time (at least 1 day).')
+        return expiry_days
+    
+    def open_upload(original_filename, content_type, fields):
+        if not original_filename:
+            raise UploadRejected('No file selected.')
+        if not allowed_file(original_filename):
+            raise UploadRejected('File type not allowed.')
+        if 'expiry_days' in fields:
+            # Reject before any bytes are stored when the field precedes the file
+            parse_expiry_days(fields['expiry_days'])
+        
+        if OFFLOAD_UPLOADS:
+            return LocalFileUpload(spool_path())
+        
+        # Stream to a staging key while hashing; the blob key depends on the digest
+        staged_key = staging_storage_key()
+        content_encoding = 'gzip' if is_compressible(original_filename) else None
+        if USE_S3:
+            writer = S3MultipartUpload(staged_key, content_type, content_encoding=content_encoding)
+        else:
+            writer = LocalFileUpload(staged_key)
+        
+        if content_encoding:
+            # Hash the original bytes, store the compressed ones
+            writer = CompressingUpload(writer)
+        return HashingUpload(writer)
+    
+    try:
+        fields, upload = stream_multipart_upload(
+            request.stream,
+            request.headers.get('Content-Type', ''),
+            open_upload,
+            MAX_FILE_SIZE
+        )
+    except UploadRejected as e:
+        return upload_failed(str(e))
+    except Exception as e:
+        return upload_failed(f'Upload failed: {str(e)}', 500)
+    
+    if upload is None:
+        return upload_failed('No file selected.')
+    
+    staged_key = upload['result']  # S3 key or local path
+    
+    try:
+        expiry_days = parse_expiry_days(fields.get('expiry_days'))
+    except UploadRejected as e:
+        # Don't leave an orphaned object behind
+        if OFFLOAD_UPLOADS:
+            os.remove(staged_key)
+        else:
+            discard_staged_file(staged_key)
+        return upload_failed(str(e))
+    
+    if OFFLOAD_UPLOADS:
+        return spool_upload(None, upload['filename'], upload['size'], expiry_days, spooled_path=staged_key)
+    
+    try:
+        success, result = store_staged_file(
+            staged_key,
+            upload['writer'].sha256,
+            upload['size'],
+            content_encoding='gzip' if is_compressible(upload['filename']) else None
+        )
+        if not success:
+            return upload_failed(f'Upload failed: {result}', 502)
+        
+        blob = result
+        new_file = File.from_blob(
+            blob,
+            user_id=current_user.id,
+            filename=secure_filename(upload['filename']),
+            file_size=upload['size'],
+            expiry_time=datetime.utcnow() + timedelta(days=expiry_days)
+        )
+        add_file_with_unique_name(new_file)
+        db.session.commit()
+        
+        storage_type = "S3" if USE_S3 else "local"
+        return upload_succeeded(new_file, f'File "{new_file.filename}" uploaded successfully to {storage_type}!')
+    except QuotaExceeded as e:
+        release_rejected_blob(blob)
+        return upload_failed(str(e), 413)
+    except Exception as e:
+        db.session.rollback()
+        return upload_failed(f'Upload failed: {str(e)}', 500)
+
+
+@files_bp.route('/upload/batch', methods=['POST'])
+@login_required
+@admit_upload(BATCH_UPLOAD_MAX_FILES * (MAX_FILE_SIZE + UPLOAD_FORM_OVERHEAD), json_errors=True, check_quota=False)
+def upload_batch():
+    """
+    Upload many files in one request
+    
+    Valid files are stored in parallel and all their rows are inserted in
+    a single commit. Responds with a JSON summary giving the outcome of
+    every submitted file. The quota is checked file by file as the rows
+    are added, not against the whole body, so the files that fit are kept
+    and only those that would go over are rejected.
+    """
+    files = [file for file in request.files.getlist('files') if file.filename]
+    expiry_days = request.form.get('expiry_days', type=int)
+    
+    if not files:
+        return jsonify({'error': 'No files selected.'}), 400
+    
+    if len(files) > BATCH_UPLOAD_MAX_FILES:
+        return jsonify({'error': f'At most {BATCH_UPLOAD_MAX_FILES} files can be uploaded at once.'}), 400
+    
+    if not expiry_days or expiry_days < 1:
+        return jsonify({'error': 'Please specify a valid expiry time (at least 1 day).'}), 400
+    
+    results = []
+    accepted = []
+    for file in files:
+        result = {'name': file.filename}
+        results.append(result)
+        
+        file.seek(0, os.SEEK_END)
+        file_size = file.tell()
+        file.seek(0)
+        
+        if not allowed_file(file.filename):
+            result.update(status='rejected', error='File type not allowed.')
+        elif file_size > MAX_FILE_SIZE:
+            result.update(status='rejected', error=f'File size exceeds maximum allowed size ({MAX_FILE_SIZE // (1024*1024)}MB).')
+        else:
+            accepted.append((file, file_size, result))
+    
+    try:
+        stored = store_files(
+            [file for file, _, _ in accepted],
+            compress=[is_compressible(file.filename) for file, _, _ in accepted]
+        )
+        expiry_time = datetime.utcnow() + timedelta(days=expiry_days)
+        
+        new_files = []
+        for (file, file_size, result), (success, blob) in zip(accepted, stored):
+            if not success:
+                result.update(status='failed', error=f'Upload failed: {blob}')
+                continue
+            
+            new_file = File.from_blob(
+                blob,
+                user_id=current_user.id,
+                filename=secure_filename(file.filename),
+                file_size=file_size,
+                expiry_time=expiry_time
+            )
+            try:
+                add_file_with_unique_name(new_file)
+            except QuotaExceeded as e:
+                # Later, smaller files may still fit
+                release_blob(blob)
+                result.update(status='rejected', error=str(e))
+                continue
+            new_files.append((new_file, result))
+        
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        for _, _, result in accepted:
+            result.update(status='failed', error=f'Upload failed: {str(e)}')
+        new_files = []
+    
+    for new_file, result in new_files:
+        result.update(status='uploaded', id=new_file.id, filename=new_file.filename, file_size=new_file.file_size)
+    
+    uploaded = len(new_files)
+    return jsonify({
+        'uploaded': uploaded,
+        'failed': len(results) - uploaded,
+        'files': results
+    }), 200 if uploaded else 400
+
+
+@files_bp.route('/upload/presign', methods=['POST'])
+@login_required
+def presign_upload():
+    """Issue a presigned POST policy so the browser can upload directly to S3"""
+    if not (DIRECT_UPLOADS and USE_S3):
+        return jsonify({'error': 'Direct uploads are not enabled.'}), 404
+    
+    data = request.get_json(silent=True) or {}
+    original_filename = data.get('filename') or ''
+    file_size = data.get('size')
+    expiry_days = data.get('expiry_days')
+    
+    if not original_filename:
+        return jsonify({'error': 'No file selected.'}), 400
+    
+    if not isinstance(expiry_days, int) or expiry_days < 1:
+        return jsonify({'error': 'Please specify a valid expiry time (at least 1 day).'}), 400
+    
+    if not allowed_file(original_filename):
+        return jsonify({'error': 'File type not allowed.'}), 400
+    
+    if not isinstance(file_size, int) or file_size < 0 or file_size > MAX_FILE_SIZE:
+        return jsonify({
+            'error': f'File size exceeds maximum allowed size ({MAX_FILE_SIZE // (1024*1024)}MB).'
+        }), 400
+    
+    if quota_exceeded(current_user.id, file_size):
+        return jsonify({'error': 'Upload would exceed your storage quota.'}), 413
+    
+    # The object key is opaque; the display name is allocated when the upload completes
+    filename = secure_filename(original_filename)
+    s3_key = new_object_key(current_user.id)
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    
+    success, result = generate_presigned_upload(
+        s3_key, MAX_FILE_SIZE, content_type, PRESIGNED_POST_EXPIRY_SECONDS
+    )
+    if not success:
+        return jsonify({'error': f'Upload failed: {result}'}), 502
+    
+    token = direct_upload_serializer.dumps({
+        'user_id': current_user.id,
+        'filename': filename,
+        's3_key': s3_key,
+        'expiry_days': expiry_days
+    })
+    return jsonify({'url': result['url'], 'fields': result['fields'], 'token': token})
+
+
+@files_bp.route('/upload/complete', methods=['POST'])
+@login_required
+def complete_upload():
+    """Record a file the browser uploaded directly to S3"""
+    if not (DIRECT_UPLOADS and USE_S3):
+        return jsonify({'error': 'Direct uploads are not enabled.'}), 404
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        # Allow a little slack past the policy expiry for the upload to finish
+        upload = direct_upload_serializer.loads(
+            data.get('token') or '', max_age=PRESIGNED_POST_EXPIRY_SECONDS * 2
+        )
+    except SignatureExpired:
+        return jsonify({'error': 'Upload session expired. Please try again.'}), 400
+    except BadSignature:
+        return jsonify({'error': 'Invalid upload token.'}), 400
+    
+    if upload['user_id'] != current_user.id:
+        abort(403)
+    
+    if File.query.filter_by(user_id=current_user.id, filepath=upload['s3_key']).first():
+        return jsonify({'error': 'Upload already completed.'}), 409
+    
+    success, head = head_object_in_s3(upload['s3_key'])
+    if not success:
+        return jsonify({'error': f'Upload failed: {head}'}), 400
+    
+    file_size = head['ContentLength']
+    if file_size > MAX_FILE_SIZE:
+        delete_file_from_s3(current_user.id, upload['filename'], s3_key=upload['s3_key'])
+        return jsonify({
+            'error': f'File size exceeds maximum allowed size ({MAX_FILE_SIZE // (1024*1024)}MB).'
+        }), 400
+    
+    try:
+        new_file = File(
+            user_id=current_user.id,
+            filename=upload['filename'],
+            filepath=upload['s3_key'],
+            file_size=file_size,
+            expiry_time=datetime.utcnow() + timedelta(days=upload['expiry_days'])
+        )
+        add_file_with_unique_name(new_file)
+        db.session.commit()
+    except QuotaExceeded as e:
+        db.session.rollback()
+        delete_file_from_s3(current_user.id, upload['filename'], s3_key=upload['s3_key'])
+        return jsonify({'error': str(e)}), 413
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Upload failed: {str(e)}'}), 500
+    
+    flash(f'File "{new_file.filename}" uploaded successfully to S3!', 'success')
+    return jsonify({'id': new_file.id, 'filename': new_file.filename, 'file_size': file_size})
+
+
+def get_owned_upload_session(upload_id):
+    """Load a resumable upload session belonging to the current user"""
+    upload_session = UploadSession.query.get_or_404(upload_id)
+    if upload_session.user_id != current_user.id:
+        abort(403)
+    return upload_session
+
+
+def upload_session_status(upload_session):
+    """JSON-serializable progress of a resumable upload"""
+    received = sorted(part.part_number for part in upload_session.parts)
+    received_set = set(received)
+    return {
+        'upload_id': upload_session.id,
+        'filename': upload_session.filename,
+        'file_size': upload_session.file_size,
+        'chunk_size': upload_session.chunk_size,
+        'total_chunks': upload_session.total_chunks,
+        'received': received,
+        'missing': [n for n in range(1, upload_session.total_chunks + 1) if n not in received_set]
+    }
+
+
+@files_bp.route('/uploads', methods=['POST'])
+@login_required
+def create_resumable_upload():
+    """Start a resumable upload session"""
+    data = request.get_json(silent=True) or {}
+    original_filename = data.get('filename') or ''
+    file_size = data.get('size')
+    expiry_days = data.get('expiry_days')
+    
+    if not original_filename:
+        return jsonify({'error': 'No file selected.'}), 400
+    
+    if not isinstance(expiry_days, int) or expiry_days < 1:
+        return jsonify({'error': 'Please specify a valid expiry time (at least 1 day).'}), 400
+    
+    if not allowed_file(original_filename):
+        return jsonify({'error': 'File type not allowed.'}), 400
+    
+    if not isinstance(file_size, int) or file_size < 0 or file_size > MAX_FILE_SIZE:
+        return jsonify({
+            'error': f'File size exceeds maximum allowed size ({MAX_FILE_SIZE // (1024*1024)}MB).'
+        }), 400
+    
+    # Resumable chunks are admitted against the size declared here
+    if quota_exceeded(current_user.id, file_size):
+        return jsonify({'error': 'Upload would exceed your storage quota.'}), 413
+    
+    # The display name is allocated when the upload completes
+    filename = secure_filename(original_filename)
+    
+    try:
+        success, result = create_upload_session(current_user.id, filename, file_size, expiry_days)
+        if not success:
+            return jsonify({'error': f'Upload failed: {result}'}), 502
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Upload failed: {str(e)}'}), 500
+    
+    return jsonify(upload_session_status(result)), 201
+
+
+@files_bp.route('/uploads/<upload_id>', methods=['GET'])
+@login_required
+def resumable_upload_status(upload_id):
+    """Report which chunks of a resumable upload the server already has"""
+    return jsonify(upload_session_status(get_owned_upload_session(upload_id)))
+
+
+@files_bp.route('/uploads/<upload_id>/chunks/<int:part_number>', methods=['PUT'])
+@login_required
+@admit_upload(RESUMABLE_CHUNK_SIZE, json_errors=True, check_quota=False)
+def upload_chunk(upload_id, part_number):
+    """Store one chunk of a resumable upload (chunks may arrive in any order)"""
+    upload_session = get_owned_upload_session(upload_id)
+    
+    if part_number < 1 or part_number > upload_session.total_chunks:
+        return jsonify({'error': f'Chunk number must be between 1 and {upload_session.total_chunks}.'}), 400
+    
+    expected_size = upload_session.expected_chunk_size(part_number)
+    if request.content_length is not None and request.content_length != expected_size:
+        return jsonify({'error': f'Chunk {part_number} must be exactly {expected_size} bytes.'}), 400
+    
+    data = request.get_data(cache=False)
+    if len(data) != expected_size:
+        return jsonify({'error': f'Chunk {part_number} must be exactly {expected_size} bytes.'}), 400
+    
+    try:
+        success, result = store_chunk(upload_session, part_number, data)
+        if not success:
+            db.session.rollback()
+            return jsonify({'error': f'Upload failed: {result}'}), 502
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Upload failed: {str(e)}'}), 500
+    
+    return jsonify({'part_number': part_number, 'size': len(data)})
+
+
+@files_bp.route('/uploads/<upload_id>/complete', methods=['POST'])
+@login_required
+def complete_resumable_upload(upload_id):
+    """Assemble a resumable upload once every chunk has been received"""
+    upload_session = get_owned_upload_session(upload_id)
+    status = upload_session_status(upload_session)
+    if status['missing']:
+        return jsonify({'error': 'Upload is incomplete.', 'missing': status['missing']}), 409
+    
+    success, result = finish_upload_session(upload_session)
+    if not success:
+        db.session.rollback()
+        return jsonify({'error': f'Upload failed: {result}'}), 502
+    
+    try:
+        new_file = File.from_blob(
+            result,
+            user_id=current_user.id,
+            filename=upload_session.filename,
+            file_size=upload_session.file_size,
+            expiry_time=datetime.utcnow() + timedelta(days=upload_session.expiry_days)
+        )
+        add_file_with_unique_name(new_file)
+        db.session.delete(upload_session)
+        db.session.commit()
+    except QuotaExceeded as e:
+        # The chunks are already assembled into the blob, so the session can't be retried
+        db.session.delete(upload_session)
+        release_rejected_blob(result)
+        return jsonify({'error': str(e)}), 413
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Upload failed: {str(e)}'}), 500
+    
+    return jsonify({'id': new_file.id, 'filename': new_file.filename, 'file_size': new_file.file_size})
+
+
+@files_bp.route('/uploads/<upload_id>', methods=['DELETE'])
+@login_required
+def abort_resumable_upload(upload_id):
+    """Abandon a resumable upload and free its stored chunks"""
+    upload_session = get_owned_upload_session(upload_id)
+    try:
+        discard_upload_session(upload_session)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Abort failed: {str(e)}'}), 500
+    
+    return jsonify({'upload_id': upload_id, 'aborted': True})
+
+
+def negotiated_encoding(file_record):
+    """Content-Encoding a download of this file is sent with (None for the original bytes)"""
+    if file_record.content_encoding and request.accept_encodings[file_record.content_encoding]:
+        return file_record.content_encoding
+    return None
+
+
+def file_etag(file_record, content_encoding):
+    """
+    Strong ETag of one representation of a file
+    
+    Derived from the recorded digest, or for files the server never read
+    from the row's id, upload time and size (a row's content never changes).
+    """
+    if file_record.sha256:
+        tag = file_record.sha256
+    else:
+        tag = f"{file_record.id}-{file_record.upload_time:%Y%m%d%H%M%S}-{file_record.file_size}"
+    if content_encoding:
+        return f"{tag}-{content_encoding}"
+    return tag
+
+
+def file_last_modified(file_record):
+    """Last-Modified of a file: its upload time, to the second, in UTC"""
+    return file_record.upload_time.replace(microsecond=0, tzinfo=timezone.utc)
+
+
+def not_modified(file_record, content_encoding):
+    """
+    Whether a conditional GET can be answered with 304 from the file's row alone
+    
+    If-None-Match takes precedence over If-Modified-Since, as in RFC 7232.
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(file_etag(file_record, content_encoding))
+    if request.if_modified_since:
+        return file_last_modified(file_record) <= request.if_modified_since
+    return False
+
+
+def send_stored_file(file_record, source, mimetype=None):
+    """
+    Send a file's stored bytes (path or file object), negotiating Content-Encoding
+    
+    Compressed files are sent as stored when the client accepts their
+    encoding and decompressed on the fly otherwise. Always sends the whole
+    file: Range and conditional requests are answered before this is called.
+    """
+    content_encoding = negotiated_encoding(file_record)
+    
+    if content_encoding or not file_record.content_encoding:
+        response = send_file(
+            source, as_attachment=True, download_name=file_record.filename, mimetype=mimetype,
+            conditional=False
+        )
+        response.accept_ranges = 'bytes'
+    else:
+        response = send_file(
+            gzip.open(source, 'rb'),
+            as_attachment=True,
+            download_name=file_record.filename,
+            mimetype=mimetype,
+            conditional=False
+        )
+        response.content_length = file_record.file_size
+    
+    set_validators(response, file_record, content_encoding)
+    if content_encoding:
+        response.headers['Content-Encoding'] = content_encoding
+    return response
+
+
+def stream_stored_file(file_record, chunks, stored_size):
+    """
+    Stream a file's stored bytes from an iterator of chunks, negotiating Content-Encoding
+    
+    Counterpart of send_stored_file for storage that can't be handed to
+    send_file. Content-Length is always set, from the stored size or, when
+    decompressing on the fly, the original size.
+    """
+    content_encoding = negotiated_encoding(file_record)
+    decompress = file_record.content_encoding and not content_encoding
+    if decompress:
+        chunks = decompress_chunks(chunks)
+    
+    response = Response(chunks, mimetype='application/octet-stream', direct_passthrough=True)
+    response.content_length = file_record.file_size if decompress else stored_size
+    if not decompress:
+        # Only the stored bytes can be served in ranges
+        response.accept_ranges = 'bytes'
+    set_download_headers(response, file_record, content_encoding)
+    return response
+
+
+def set_download_headers(response, file_record, content_encoding):
+    """Add the attachment, validator and encoding headers shared by streamed downloads"""
+    response.headers.set('Content-Disposition', 'attachment', filename=file_record.filename)
+    set_validators(response, file_record, content_encoding)
+    if content_encoding:
+        response.headers['Content-Encoding'] = content_encoding
+
+
+def set_validators(response, file_record, content_encoding):
+    """Add ETag and Last-Modified (and Vary for files with several encodings)"""
+    response.set_etag(file_etag(file_record, content_encoding))
+    response.last_modified = file_last_modified(file_record)
+    if file_record.content_encoding:
+        response.vary.add('Accept-Encoding')
+
+
+def send_byte_ranges(file_record, content_encoding, length, read_range):
+    """
+    Answer a Range request for the stored representation of a file
+    
+    Returns:
+        Response: 206 or 416 response, or None if the full file should be sent
+    """
+    ranges = requested_ranges(length, file_etag(file_record, content_encoding), file_last_modified(file_record))
+    if ranges is None:
+        return None
+    if not ranges:
+        return range_not_satisfiable(length)
+    
+    mimetype = mimetypes.guess_type(file_record.filename)[0] or 'application/octet-stream'
+    response = range_response(ranges, length, read_range, mimetype=mimetype)
+    set_download_headers(response, file_record, content_encoding)
+    return response
+
+
+def proxy_sendfile(file_record, path, mimetype=None):
+    """
+    Hand a local file to the front proxy to send with sendfile(2)
+    
+    The response carries only headers: nginx gets an X-Accel-Redirect to
+    the internal location aliased to UPLOAD_FOLDER, other servers an
+    X-Sendfile with the absolute path. The proxy then serves the bytes
+    (and any Range) itself. Compressed files and files outside
+    UPLOAD_FOLDER are left to Flask.
+    
+    Returns:
+        Response: Header-only response, or None if the file can't be offloaded
+    """
+    upload_root = os.path.abspath(UPLOAD_FOLDER)
+    path = os.path.abspath(path)
+    if not PROXY_SENDFILE or file_record.content_encoding or not path.startswith(upload_root + os.sep):
+        return None
+    
+    response = Response(mimetype=mimetype or mimetypes.guess_type(file_record.filename)[0] or 'application/octet-stream')
+    response.headers.set('Content-Disposition', 'attachment', filename=file_record.filename)
+    set_validators(response, file_record, None)
+    if PROXY_SENDFILE == 'nginx':
+        relative_path = os.path.relpath(path, upload_root).replace(os.sep, '/')
+        response.headers['X-Accel-Redirect'] = f"{PROXY_SENDFILE_PREFIX.rstrip('/')}/{quote(relative_path)}"
+    else:
+        response.headers['X-Sendfile'] = path
+    return response
+
+
+def send_local_file(file_record, path, content_encoding, ranged, mimetype=None):
+    """Send a file's stored bytes from a local path, answering Range requests by seeking"""
+    response = proxy_sendfile(file_record, path, mimetype=mimetype)
+    if response:
+        return response
+    
+    if ranged:
+        response = send_byte_ranges(file_record, content_encoding, os.path.getsize(path), file_range_reader(path))
+        if response:
+            return response
+    return send_stored_file(file_record, path, mimetype=mimetype)
 
 
 @files_bp.route('/download/<int:file_id>')
@@ -145,38 +937,107 @@ def download_file(file_id):
     if file_record.user_id != current_user.id:
         abort(403)
     
+    # Revalidations are answered from the row without touching storage
+    content_encoding = negotiated_encoding(file_record)
+    if not_modified(file_record, content_encoding):
+        response = make_response('', 304)
+        set_validators(response, file_record, content_encoding)
+        return response
+    
+    # Ranges are served over the stored bytes, so not when decompressing on the fly
+    ranged = 'Range' in request.headers and content_encoding == file_record.content_encoding
+    
     try:
+        if file_record.storage_state == 'pending':
+            # Not offloaded yet, serve the spooled copy
+            return send_local_file(file_record, file_record.filepath, content_encoding, ranged)
+        
+        if USE_S3 and PRESIGNED_DOWNLOADS and content_encoding == file_record.content_encoding:
+            # S3 serves the bytes (with the stored Content-Encoding) straight to the client
+            content_type = mimetypes.guess_type(file_record.filename)[0] or 'application/octet-stream'
+            success, result = generate_presigned_download(
+                file_record.filepath, file_record.filename, content_type, PRESIGNED_GET_EXPIRY_SECONDS
+            )
+            if not success:
+                flash(f'Download failed: {result}', 'error')
+                return redirect(url_for('files.dashboard'))
+            return redirect(result)
+        
         if USE_S3:
-            # Download from S3
-            success, result = download_file_from_s3(file_record.user_id, file_record.filename)
+            cached_path = cached_object_path(
+                file_record.filepath,
+                file_record.file_size,
+                object_version(file_record.blob_id, file_record.content_encoding, file_record.id)
+            )
+            if cached_path:
+                # Hot objects are served from the local cache like local files
+                return send_local_file(
+                    file_record, cached_path, content_encoding, ranged, mimetype='application/octet-stream'
+                )
+            
+            if ranged:
+                # Each range is fetched with its own ranged GET
+                length = file_record.file_size
+                if file_record.content_encoding:
+                    success, result = head_object_in_s3(file_record.filepath)
+                    if not success:
+                        flash(f'Download failed: {result}', 'error')
+                        return redirect(url_for('files.dashboard'))
+                    length = result['ContentLength']
+                response = send_byte_ranges(
+                    file_record, content_encoding, length, s3_range_reader(file_record.filepath)
+                )
+                if response:
+                    return response
+            
+            # Stream from S3 chunk by chunk instead of buffering the whole object
+            success, result = stream_file_from_s3(file_record.filepath)
             if not success:
                 flash(f'Download failed: {result}', 'error')
                 return redirect(url_for('files.dashboard'))
             
-            # result is a BytesIO object
-            file_data = result
-            return send_file(
-                file_data,
-                as_attachment=True,
-                download_name=file_record.filename,
-                mimetype='application/octet-stream'
-            )
+            chunks, stored_size = result
+            return stream_stored_file(file_record, chunks, stored_size)
         else:
             # Download from local storage
             if not os.path.exists(file_record.filepath):
                 flash('File not found on server.', 'error')
                 return redirect(url_for('files.dashboard'))
             
-            return send_file(
-                file_record.filepath,
-                as_attachment=True,
-                download_name=file_record.filename
-            )
+            return send_local_file(file_record, file_record.filepath, content_encoding, ranged)
     except Exception as e:
         flash(f'Download failed: {str(e)}', 'error')
         return redirect(url_for('files.dashboard'))
 
 
+@files_bp.route('/download/zip', methods=['POST'])
+@login_required
+def download_zip():
+    """Download several files as one ZIP archive, streamed while it is built"""
+    file_ids = set(request.form.getlist('file_ids', type=int))
+    if not file_ids:
+        flash('Select at least one file to download.', 'error')
+        return redirect(url_for('files.dashboard'))
+    
+    if len(file_ids) > ZIP_EXPORT_MAX_FILES:
+        flash(f'At most {ZIP_EXPORT_MAX_FILES} files can be downloaded at once.', 'error')
+        return redirect(url_for('files.dashboard'))
+    
+    file_records = File.query.filter(
+        File.user_id == current_user.id, File.id.in_(file_ids)
+    ).order_by(File.filename).all()
+    
+    # Check ownership (ids of other users' files are simply not found above)
+    if len(file_records) != len(file_ids):
+        abort(404)
+    
+    response = Response(stream_with_context(stream_zip(file_records)), mimetype='application/zip')
+    response.headers.set(
+        'Content-Disposition', 'attachment', filename=f"autovault-{datetime.utcnow():%Y%m%d-%H%M%S}.zip"
+    )
+    return response
+
+
 @files_bp.route('/delete/<int:file_id>', methods=['POST'])
 @login_required
 def delete_file(file_id):
@@ -188,25 +1049,28 @@ def delete_file(file_id):
         abort(403)
     
     try:
-        if USE_S3:
-            # Delete from S3
-            success, message = delete_file_from_s3(file_record.user_id, file_record.filename)
-            if not success:
-                flash(f'Delete failed: {message}', 'error')
-                return redirect(url_for('files.dashboard'))
-        else:
-            # Delete from local filesystem
-            if os.path.exists(file_record.filepath):
-                os.remove(file_record.filepath)
+        # Release stored content (S3 or local); shared blobs are kept until their last file goes
+        success, message = delete_stored_file(file_record)
+        if not success:
+            if wants_json():
+                return jsonify({'error': f'Delete failed: {message}'}), 502
+            flash(f'Delete failed: {message}', 'error')
+            return redirect(url_for('files.dashboard'))
         
         # Delete from database
         db.session.delete(file_record)
+        file_removed(file_record)
+        queue_event(file_record.user_id, 'file_removed', {'id': file_id})
         db.session.commit()
         
+        if wants_json():
+            return jsonify({'deleted': file_id})
         storage_type = "S3" if USE_S3 else "local"
         flash(f'File "{file_record.filename}" deleted successfully from {storage_type}.', 'success')
     except Exception as e:
         db.session.rollback()
+        if wants_json():
+            return jsonify({'error': f'Delete failed: {str(e)}'}), 500
         flash(f'Delete failed: {str(e)}', 'error')
     
     return redirect(url_for('files.dashboard'))
@@ -227,8 +1091,12 @@ def test_scheduler():
         files_after = File.query.count()
         deleted = files_before - files_after
         
+        if wants_json():
+            return jsonify({'deleted': deleted})
         flash(f'Scheduler test completed. {deleted} file(s) deleted.', 'success')
     except Exception as e:
+        if wants_json():
+            return jsonify({'error': f'Scheduler test failed: {str(e)}'}), 500
         flash(f'Scheduler test failed: {str(e)}', 'error')
     
     return redirect(url_for('files.dashboard'))
@@ -82,18 +82,46 @@ AutoVault System
         return False
 
 
-def delete_file_from_s3(user_id, filename):
+def delete_file_from_s3(s3_key):
     """Delete file from S3"""
     try:
-        s3_key = f"{S3_BUCKET_PREFIX}/user_{user_id}/{filename}"
         s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=s3_key)
         print(f"[S3] Deleted: {s3_key}")
         return True
     except Exception as e:
-        print(f"[S3] Failed to delete {filename}: {str(e)}")
+        print(f"[S3] Failed to delete {s3_key}: {str(e)}")
         return False
 
 
+def release_file_storage(cursor, file):
+    """
+    Release the S3 object behind a file row
+    
+    Files in the blob store drop one reference and the shared object is only
+    deleted with its last reference. Must run after the file row is deleted.
+    """
+    if file['storage_state'] == 'pending':
+        # Still in the app server's spool, which removes it once the row is gone
+        return True
+    
+    if file['blob_id'] is None:
+        return delete_file_from_s3(file['filepath'])
+    
+    cursor.execute(
+        "UPDATE blobs SET refcount = refcount - 1 WHERE id = %s RETURNING refcount, storage_key",
+        (file['blob_id'],)
+    )
+    blob = cursor.fetchone()
+    if blob['refcount'] > 0:
+        print(f"[Lambda] Blob {file['blob_id']} still referenced by {blob['refcount']} file(s)")
+        return True
+    
+    if not delete_file_from_s3(blob['storage_key']):
+        return False
+    cursor.execute("DELETE FROM blobs WHERE id = %s", (file['blob_id'],))
+    return True
+
+
 def process_expired_files():
     """Main function to process expired files"""
     now = datetime.utcnow()
@@ -112,7 +140,7 @@ def process_expired_files():
         # Files expiring within the next (NOTIFICATION_HOURS_BEFORE_EXPIRY + 1) hours
         query = """
             SELECT f.id, f.user_id, f.filename, f.filepath, f.expiry_time, f.email_sent,
-                   u.email as user_email
+                   f.blob_id, f.storage_state, f.file_size, u.email as user_email
             FROM files f
             JOIN users u ON f.user_id = u.id
             WHERE f.expiry_time > %s - INTERVAL '%s hours'
@@ -136,13 +164,22 @@ def process_expired_files():
                 
                 # Check if file has expired
                 if expiry_time < now:
-                    # Delete expired file
-                    if delete_file_from_s3(user_id, filename):
-                        # Delete from database
-                        cursor.execute("DELETE FROM files WHERE id = %s", (file_id,))
+                    # Delete expired file; keep the row if its storage can't be released
+                    cursor.execute("SAVEPOINT delete_file")
+                    cursor.execute("DELETE FROM files WHERE id = %s", (file_id,))
+                    cursor.execute(
+                        """UPDATE user_usage
+                           SET total_bytes = total_bytes - %s, file_count = file_count - 1,
+                               listing_version = listing_version + 1
+                           WHERE user_id = %s""",
+                        (file['file_size'] or 0, user_id)
+                    )
+                    if release_file_storage(cursor, file):
+                        cursor.execute("RELEASE SAVEPOINT delete_file")
                         deleted_count += 1
                         print(f"[Lambda] Deleted expired file: {filename} (ID: {file_id})")
                     else:
+                        cursor.execute("ROLLBACK TO SAVEPOINT delete_file")
                         errors.append(f"Failed to delete file {filename} from S3")
                 
                 # Check if notification should be sent
@@ -0,0 +1,183 @@
+"""
+File Listing
+Keyset-paginated listing of a user's files, newest first. Pages are read
+from the (user_id, upload_time, id) index with a cursor instead of an
+offset, and expiry status is computed in SQL, so a page costs the same
+however many files the user has.
+"""
+from models import db, File
+from config import DASHBOARD_PAGE_SIZE
+from search import filename_filter
+from sqlalchemy import case, func, select, tuple_
+from datetime import datetime, timedelta
+
+# Files expiring within this many hours are flagged as expiring soon
+EXPIRING_SOON_HOURS = 24
+
+CURSOR_TIME_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+def encode_cursor(row):
+    """Opaque cursor for the position of a listed file"""
+    return f"{row.upload_time.strftime(CURSOR_TIME_FORMAT)}-{row.id}"
+
+
+def decode_cursor(cursor):
+    """
+    Position encoded by encode_cursor
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    upload_time, _, file_id = cursor.partition('-')
+    return datetime.strptime(upload_time, CURSOR_TIME_FORMAT), int(file_id)
+
+
+def file_listing_query(user_id, search=None, prefix=False):
+    """
+    Query for a user's files as rows carrying a SQL-computed status ('expired', 'expiring' or 'active')
+
+    Args:
+        user_id: User ID
+        search: Only files whose name contains this (case-insensitive)
+        prefix: Only files whose name starts with search instead
+    """
+    now = datetime.utcnow()
+    status = case(
+        (File.expiry_time < now, 'expired'),
+        (File.expiry_time < now + timedelta(hours=EXPIRING_SOON_HOURS), 'expiring'),
+        else_='active'
+    ).label('status')
+    query = db.session.query(
+        File.id,
+        File.filename,
+        File.file_size,
+        File.upload_time,
+        File.expiry_time,
+        File.storage_state,
+        status
+    ).filter(File.user_id == user_id)
+    if search:
+        query = query.filter(filename_filter(search, prefix))
+    return query
+
+
+def file_status(expiry_time, now=None):
+    """Status of a single file, computed as file_listing_query does in SQL"""
+    now = now or datetime.utcnow()
+    if expiry_time < now:
+        return 'expired'
+    if expiry_time < now + timedelta(hours=EXPIRING_SOON_HOURS):
+        return 'expiring'
+    return 'active'
+
+
+def expiring_count(user_id, now=None):
+    """Number of a user's files whose status is 'expiring', counted on the (user_id, expiry_time) index"""
+    now = now or datetime.utcnow()
+    return db.session.query(func.count(File.id)).filter(
+        File.user_id == user_id,
+        File.expiry_time >= now,
+        File.expiry_time < now + timedelta(hours=EXPIRING_SOON_HOURS)
+    ).scalar()
+
+
+def file_json(row, status=None):
+    """
+    JSON-ready fields of a listed file (timestamps are UTC, ISO 8601)
+
+    Args:
+        row: Row from file_listing_query, or a File with its status given
+        status: Status of a File, which carries none of its own
+    """
+    return {
+        'id': row.id,
+        'filename': row.filename,
+        'file_size': row.file_size,
+        'upload_time': row.upload_time.isoformat() + 'Z',
+        'expiry_time': row.expiry_time.isoformat() + 'Z',
+        'status': status or row.status,
+        'storage_state': row.storage_state
+    }
+
+
+def next_status_change(rows):
+    """
+    When the SQL-computed status of any listed file next changes
+
+    Returns:
+        datetime: Earliest upcoming change, or None if every file has expired
+    """
+    changes = [
+        row.expiry_time - timedelta(hours=EXPIRING_SOON_HOURS) if row.status == 'active' else row.expiry_time
+        for row in rows if row.status != 'expired'
+    ]
+    return min(changes, default=None)
+
+
+def next_user_status_change(user_id, now=None):
+    """
+    When the status of any of a user's files next changes
+
+    Answered with two seeks on the (user_id, expiry_time) index: the next
+    file to expire, and the next one to enter the expiring soon window.
+
+    Returns:
+        datetime: Earliest upcoming change, or None if every file has expired
+    """
+    now = now or datetime.utcnow()
+    window = timedelta(hours=EXPIRING_SOON_HOURS)
+
+    def first_expiry_from(start):
+        return select(func.min(File.expiry_time)).where(
+            File.user_id == user_id, File.expiry_time >= start
+        ).scalar_subquery()
+
+    next_expiry, next_outside_window = db.session.query(
+        first_expiry_from(now), first_expiry_from(now + window)
+    ).one()
+    changes = [next_expiry]
+    if next_outside_window is not None:
+        changes.append(next_outside_window - window)
+    return min((change for change in changes if change is not None), default=None)
+
+
+def list_files(user_id, after=None, before=None, limit=DASHBOARD_PAGE_SIZE, search=None, prefix=False):
+    """
+    One page of a user's files, newest first
+
+    Args:
+        user_id: User ID
+        after: Cursor of the last file on the previous page (next page)
+        before: Cursor of the first file on the following page (previous page)
+        limit: Files per page
+        search: Only files whose name contains this (see search.py)
+        prefix: Match search at the start of the name only
+
+    Returns:
+        tuple: (rows, prev_cursor, next_cursor), cursors None at either end
+
+    Raises:
+        ValueError: If a cursor is malformed
+    """
+    query = file_listing_query(user_id, search, prefix)
+    position = tuple_(File.upload_time, File.id)
+
+    if before:
+        rows = query.filter(position > decode_cursor(before)).order_by(
+            File.upload_time.asc(), File.id.asc()
+        ).limit(limit + 1).all()
+        if len(rows) > limit:
+            rows = rows[:limit][::-1]
+            return rows, encode_cursor(rows[0]), encode_cursor(rows[-1])
+        # Fewer than a page of newer files left, so this is the first page
+        return list_files(user_id, limit=limit, search=search, prefix=prefix)
+
+    if after:
+        query = query.filter(position < decode_cursor(after))
+    rows = query.order_by(File.upload_time.desc(), File.id.desc()).limit(limit + 1).all()
+
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    rows = rows[:limit]
+    prev_cursor = encode_cursor(rows[0]) if after and rows else None
+    return rows, prev_cursor, next_cursor
@@ -33,6 +33,14 @@ class User(UserMixin, db.Model):
 class File(db.Model):
     """File model for storing file metadata"""
     __tablename__ = 'files'
+    __table_args__ = (
+        # Display names are unique per user; also serves name allocation lookups
+        db.UniqueConstraint('user_id', 'filename', name='uq_files_user_filename'),
+        # Keyset pagination of a user's files, newest first
+        db.Index('ix_files_user_upload_time', 'user_id', 'upload_time', 'id'),
+        # Counting a user's files expiring soon
+        db.Index('ix_files_user_expiry_time', 'user_id', 'expiry_time'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
@@ -42,10 +50,31 @@ class File(db.Model):
     upload_time = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     expiry_time = db.Column(db.DateTime, nullable=False, index=True)
     email_sent = db.Column(db.Boolean, default=False, nullable=False)
+    blob_id = db.Column(db.Integer, db.ForeignKey('blobs.id'), index=True)  # None for files stored outside the blob store
+    storage_state = db.Column(db.String(16), default='ready', nullable=False)  # 'pending' while spooled locally, awaiting offload
+    content_encoding = db.Column(db.String(16))  # 'gzip' if stored compressed; file_size is always the original size
+    sha256 = db.Column(db.String(64))  # Digest of the original bytes; None for files the server never read
+    
+    # Relationship
+    blob = db.relationship('Blob', backref='files', lazy=True)
     
     def __repr__(self):
         return f'<File {self.filename}>'
     
+    @classmethod
+    def from_blob(cls, blob, **kwargs):
+        """New File whose content is stored in a blob"""
+        file_record = cls(**kwargs)
+        file_record.attach_blob(blob)
+        return file_record
+    
+    def attach_blob(self, blob):
+        """Point the file at a blob, taking its storage key, encoding and digest"""
+        self.filepath = blob.storage_key  # S3 key or local path
+        self.blob_id = blob.id
+        self.content_encoding = blob.content_encoding
+        self.sha256 = blob.sha256
+    
     def is_expired(self):
         """Check if file has expired"""
         return datetime.utcnow() > self.expiry_time
@@ -55,3 +84,76 @@ class File(db.Model):
         delta = self.expiry_time - datetime.utcnow()
         return delta.total_seconds() / 3600
 
+
+class Blob(db.Model):
+    """Content-addressed stored object shared by every File with the same bytes"""
+    __tablename__ = 'blobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False, index=True)
+    storage_key = db.Column(db.String(500), nullable=False)  # S3 key or local path
+    size = db.Column(db.Integer, nullable=False)  # Original size in bytes
+    content_encoding = db.Column(db.String(16))  # 'gzip' if the stored object is compressed
+    refcount = db.Column(db.Integer, default=1, nullable=False)  # Number of File rows pointing here
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f'<Blob {self.sha256[:12]} refs={self.refcount}>'
+
+
+class UserUsage(db.Model):
+    """Running storage totals for one user, adjusted in the same transaction as every file insert and delete"""
+    __tablename__ = 'user_usage'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    total_bytes = db.Column(db.BigInteger, default=0, nullable=False)  # Sum of original file sizes
+    file_count = db.Column(db.Integer, default=0, nullable=False)
+    listing_version = db.Column(db.Integer, default=0, nullable=False)  # Bumped on every change to the user's files
+    
+    def __repr__(self):
+        return f'<UserUsage user={self.user_id} files={self.file_count} bytes={self.total_bytes}>'
+
+
+class UploadSession(db.Model):
+    """Resumable upload in progress, mapped onto an S3 multipart upload or local part files"""
+    __tablename__ = 'upload_sessions'
+    
+    id = db.Column(db.String(32), primary_key=True)  # Random hex token used in URLs
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    filename = db.Column(db.String(255), nullable=False)
+    file_size = db.Column(db.Integer, nullable=False)  # Declared total size in bytes
+    chunk_size = db.Column(db.Integer, nullable=False)
+    expiry_days = db.Column(db.Integer, nullable=False)
+    storage_key = db.Column(db.String(500), nullable=False)  # S3 key or local parts directory
+    s3_upload_id = db.Column(db.String(255))  # S3 multipart upload ID (S3 mode only)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    
+    # Relationship
+    parts = db.relationship('UploadPart', backref='session', lazy=True, cascade='all, delete-orphan')
+    
+    def __repr__(self):
+        return f'<UploadSession {self.id} {self.filename}>'
+    
+    @property
+    def total_chunks(self):
+        """Number of chunks the file is split into"""
+        return max(1, -(-self.file_size // self.chunk_size))
+    
+    def expected_chunk_size(self, part_number):
+        """Size in bytes the given 1-based chunk must have"""
+        if part_number < self.total_chunks:
+            return self.chunk_size
+        return self.file_size - self.chunk_size * (self.total_chunks - 1)
+
+
+class UploadPart(db.Model):
+    """Chunk of a resumable upload that the server has already stored"""
+    __tablename__ = 'upload_parts'
+    
+    session_id = db.Column(db.String(32), db.ForeignKey('upload_sessions.id'), primary_key=True)
+    part_number = db.Column(db.Integer, primary_key=True)
+    size = db.Column(db.Integer, nullable=False)
+    etag = db.Column(db.String(255))  # ETag returned by S3 for the part (S3 mode only)
+    
+    def __repr__(self):
+        return f'<UploadPart {self.session_id}#{self.part_number}>'
@@ -0,0 +1,311 @@
+"""
+S3 Object Cache
+Read-through cache of S3 objects on local disk, so files downloaded over
+and over are served at local disk speed instead of costing an S3 GET each
+time. Entries are evicted least recently used first to stay within a byte
+budget, concurrent misses for the same object share a single fetch, and
+fills are written to a temp file and renamed into place so readers never
+see a partial object.
+
+Entries are keyed on the object's key and a version identifying what is
+stored under it (see object_version), since blob keys are reused when the
+same content is stored again. A copy cached before its object was deleted
+and rewritten is therefore never served, even by a worker that didn't see
+the delete; it just ages out of the cache.
+
+Each process caches into its own directory, named after its host and PID,
+under the autovault-objects subdirectory of S3_CACHE_DIR, and keeps its
+index in memory, so workers never evict or clean up each other's files.
+The index is built on first use, which also covers workers forked after
+the module was imported. A worker starting up adopts the directory of one
+that has exited on the same host, so restarts begin with a warm cache.
+Nothing outside autovault-objects is touched. S3_CACHE_MAX_MB is split
+evenly between S3_CACHE_PROCESSES workers.
+"""
+from config import USE_S3, S3_CACHE_DIR, S3_CACHE_MAX_BYTES, S3_CACHE_PROCESSES, S3_MULTIPART_THRESHOLD
+from s3_storage import stream_file_from_s3, fetch_file_from_s3_parallel
+from collections import OrderedDict
+import hashlib
+import os
+import shutil
+import socket
+import threading
+import uuid
+
+# Objects larger than this share of the budget are never cached
+MAX_ENTRY_FRACTION = 0.25
+
+CACHE_ENABLED = USE_S3 and bool(S3_CACHE_DIR)
+
+# Each process's share of the disk budget
+PROCESS_MAX_BYTES = S3_CACHE_MAX_BYTES // S3_CACHE_PROCESSES
+
+# Directory under S3_CACHE_DIR holding the per-process directories; the only one the cache manages
+CACHE_ROOT = os.path.join(S3_CACHE_DIR, 'autovault-objects')
+
+cache_lock = threading.Lock()
+load_lock = threading.Lock()
+cache_dir = None  # This process's directory, set when its index is loaded
+cache_pid = None  # Process the index was loaded by
+entries = OrderedDict()  # Entry name -> size in bytes, least recently used first
+fills = {}  # Entry name -> Event set when its fill finishes
+cancelled_fills = set()  # Entries invalidated while being filled
+stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'bytes': 0}
+
+
+def object_version(blob_id=None, content_encoding=None, file_id=None):
+    """
+    Version of a stored object, part of its cache key
+
+    Blob rows aren't rewritten in place: content stored again after its blob
+    was deleted gets a new row (and possibly another encoding), so the id
+    and encoding change whenever different bytes are written to the key.
+    Files outside the blob store have an opaque key of their own.
+    """
+    if blob_id is not None:
+        return f"blob-{blob_id}-{content_encoding or 'identity'}"
+    return f"file-{file_id}"
+
+
+def entry_name(s3_key, version):
+    """File name an object is cached under"""
+    return hashlib.sha256(f"{s3_key}\n{version}".encode()).hexdigest()
+
+
+def process_dir_name(pid):
+    """Name of a process's directory under CACHE_ROOT"""
+    return f"{socket.gethostname()}-{pid}"
+
+
+def process_exited(pid):
+    """Whether no process with this PID is running"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def claim_cache_dirs(own_dir):
+    """
+    Take over the directories of exited processes on this host
+
+    The first one found becomes own_dir and the rest are deleted. Only
+    directories named by process_dir_name for this host are considered,
+    so processes on other hosts sharing S3_CACHE_DIR are left alone.
+    Directories are claimed by renaming them, so two processes starting
+    at once never take (or delete) the same one.
+    """
+    host_prefix = process_dir_name('')
+    for name in os.listdir(CACHE_ROOT):
+        pid = name[len(host_prefix):]
+        if not name.startswith(host_prefix) or not pid.isdigit():
+            continue
+        if int(pid) == os.getpid() or not process_exited(int(pid)):
+            continue
+        path = os.path.join(CACHE_ROOT, name)
+        try:
+            if not os.path.exists(own_dir):
+                os.rename(path, own_dir)
+                continue
+            claimed = f"{path}.{os.getpid()}.old"
+            os.rename(path, claimed)
+        except OSError:
+            continue  # Claimed by another process
+        shutil.rmtree(claimed, ignore_errors=True)
+
+
+def load_cache_index():
+    """Build this process's index from its cache directory, oldest files first, dropping leftover temp files"""
+    global cache_dir, cache_pid
+    own_dir = os.path.join(CACHE_ROOT, process_dir_name(os.getpid()))
+    os.makedirs(CACHE_ROOT, exist_ok=True)
+    claim_cache_dirs(own_dir)
+    os.makedirs(own_dir, exist_ok=True)
+
+    found = []
+    for name in os.listdir(own_dir):
+        path = os.path.join(own_dir, name)
+        if name.endswith('.tmp'):
+            os.remove(path)
+            continue
+        stat = os.stat(path)
+        found.append((stat.st_mtime, name, stat.st_size))
+
+    with cache_lock:
+        # A forked worker starts from its parent's state
+        entries.clear()
+        fills.clear()
+        cancelled_fills.clear()
+        stats.update(hits=0, misses=0, evictions=0, bytes=0)
+        cache_dir = own_dir
+        cache_pid = os.getpid()
+        for _, name, size in sorted(found):
+            entries[name] = size
+            stats['bytes'] += size
+        evict_entries()
+    print(f"[Cache] Loaded {len(entries)} cached object(s), {stats['bytes'] / (1024*1024):.2f}MB into {own_dir}")
+
+
+def ensure_cache_loaded():
+    """Load the index the first time this process uses the cache"""
+    with load_lock:
+        if cache_pid != os.getpid():
+            load_cache_index()
+
+
+def evict_entries():
+    """Remove least recently used entries until the cache fits its budget (caller holds cache_lock)"""
+    while stats['bytes'] > PROCESS_MAX_BYTES and entries:
+        name, size = entries.popitem(last=False)
+        stats['bytes'] -= size
+        stats['evictions'] += 1
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except OSError:
+            pass
+
+
+def fill_entry(s3_key, path, size):
+    """
+    Download an object into the cache directory
+
+    Objects at or above the multipart threshold are fetched with parallel
+    ranged GETs; smaller ones with a single streamed GET.
+
+    Returns:
+        int: Size of the cached file, or None if the fetch failed
+    """
+    if size >= S3_MULTIPART_THRESHOLD:
+        success, result = fetch_file_from_s3_parallel(s3_key, directory=cache_dir)
+        if not success:
+            return None
+        os.replace(result, path)
+        return os.path.getsize(path)
+
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        success, result = stream_file_from_s3(s3_key)
+        if not success:
+            return None
+        chunks, _ = result
+        with open(temp_path, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        size = os.path.getsize(temp_path)
+        os.replace(temp_path, path)
+        return size
+    except Exception as e:
+        print(f"[Cache] Failed to cache {s3_key}: {str(e)}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return None
+
+
+def cached_object_path(s3_key, size, version):
+    """
+    Local path of a cached copy of an S3 object, fetching it on a miss
+
+    A miss downloads the whole object before returning. Callers arriving
+    while the same object is being fetched wait for that fetch instead of
+    starting their own.
+
+    Args:
+        s3_key: Key of the object
+        size: Expected size in bytes (an upper bound is fine)
+        version: Version of the stored object, from object_version
+
+    Returns:
+        str: Path of the cached file, or None if the object isn't cached
+        and can't be (cache disabled, object too big, fetch failed), in
+        which case the caller reads it from S3 directly
+    """
+    if not CACHE_ENABLED or size > PROCESS_MAX_BYTES * MAX_ENTRY_FRACTION:
+        return None
+
+    ensure_cache_loaded()
+    name = entry_name(s3_key, version)
+    path = os.path.join(cache_dir, name)
+
+    with cache_lock:
+        if name in entries:
+            if os.path.exists(path):
+                entries.move_to_end(name)
+                stats['hits'] += 1
+                return path
+            # Removed behind our back (e.g. by a tmp cleaner); fetch it again
+            stats['bytes'] -= entries.pop(name)
+        fill = fills.get(name)
+        owner = fill is None
+        if owner:
+            fill = fills[name] = threading.Event()
+            stats['misses'] += 1
+
+    if not owner:
+        fill.wait()
+        with cache_lock:
+            if name not in entries:
+                return None
+            entries.move_to_end(name)
+            stats['hits'] += 1
+            return path
+
+    cached_size = None
+    try:
+        cached_size = fill_entry(s3_key, path, size)
+    finally:
+        with cache_lock:
+            del fills[name]
+            if name in cancelled_fills:
+                # Invalidated while it was being fetched
+                cancelled_fills.discard(name)
+                if cached_size is not None:
+                    os.remove(path)
+                    cached_size = None
+            if cached_size is not None:
+                entries[name] = cached_size
+                stats['bytes'] += cached_size
+                evict_entries()
+        fill.set()
+
+    return path if cached_size is not None else None
+
+
+def invalidate_cached_object(s3_key, version):
+    """
+    Drop an object from this process's cache (called when it is deleted from S3)
+
+    Only frees space early: copies cached by other processes can't be
+    reached, but are never served again since the version is gone for good.
+    """
+    if not CACHE_ENABLED:
+        return
+
+    ensure_cache_loaded()
+    name = entry_name(s3_key, version)
+    with cache_lock:
+        if name in fills:
+            cancelled_fills.add(name)
+        size = entries.pop(name, None)
+        if size is None:
+            return
+        stats['bytes'] -= size
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except OSError:
+            pass
+
+
+def cache_stats():
+    """
+    Hit and miss counters and current usage
+
+    Returns:
+        dict: hits, misses, evictions, entries, bytes, max_bytes
+    """
+    if CACHE_ENABLED:
+        ensure_cache_loaded()
+    with cache_lock:
+        return {**stats, 'entries': len(entries), 'max_bytes': PROCESS_MAX_BYTES}
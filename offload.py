@@ -0,0 +1,114 @@
+"""
+Write-Behind S3 Offload
+Uploads are written to a local spool and recorded as pending so the request
+returns at local disk speed. A background worker pool then moves each
+spooled file into the blob store on S3 and marks it ready.
+"""
+from models import db, File
+from config import UPLOAD_FOLDER, OFFLOAD_WORKERS
+from blobs import store_file, release_blob, is_compressible
+from usage import touch_listing
+from events import queue_event
+from listing import file_status, file_json
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import time
+import uuid
+
+# Spooled files live here until they have been offloaded
+SPOOL_FOLDER = os.path.join(UPLOAD_FOLDER, '.spool')
+
+# Spool files without a pending row are only removed once they are this old,
+# so files still being written by an upload request are left alone
+ORPHAN_SPOOL_AGE_SECONDS = 3600
+
+executor = ThreadPoolExecutor(max_workers=OFFLOAD_WORKERS, thread_name_prefix='offload')
+queued_ids = set()
+queued_lock = threading.Lock()
+
+
+def spool_path():
+    """Unique local path for a file waiting to be offloaded"""
+    os.makedirs(SPOOL_FOLDER, exist_ok=True)
+    return os.path.join(SPOOL_FOLDER, uuid.uuid4().hex)
+
+
+def enqueue_offload(app, file_id):
+    """Queue a committed pending file for upload (no-op if it is already queued)"""
+    with queued_lock:
+        if file_id in queued_ids:
+            return
+        queued_ids.add(file_id)
+    executor.submit(offload_file, app, file_id)
+
+
+def offload_file(app, file_id):
+    """
+    Move one spooled file into the blob store and mark its row ready
+
+    Runs on a worker thread. Failed uploads stay pending and are retried the
+    next time pending files are resumed.
+    """
+    with app.app_context():
+        try:
+            file_record = File.query.get(file_id)
+            if file_record is None or file_record.storage_state != 'pending':
+                return
+            spooled_path = file_record.filepath
+
+            with open(spooled_path, 'rb') as f:
+                success, result = store_file(f, compress=is_compressible(file_record.filename))
+            if not success:
+                db.session.rollback()
+                print(f"[Offload] Upload of {file_record.filename} failed, will retry: {result}")
+                return
+
+            blob = result
+            # The file may have been deleted while it was uploading
+            file_record = File.query.filter_by(id=file_id, storage_state='pending').with_for_update().first()
+            if file_record is None:
+                release_blob(blob)
+            else:
+                file_record.attach_blob(blob)
+                file_record.storage_state = 'ready'
+                touch_listing(file_record.user_id)
+                queue_event(file_record.user_id, 'file_updated', {'file': file_json(file_record, file_status(file_record.expiry_time))})
+            db.session.commit()
+
+            if os.path.exists(spooled_path):
+                os.remove(spooled_path)
+            print(f"[Offload] File {file_id} offloaded to {blob.storage_key}")
+        except Exception as e:
+            db.session.rollback()
+            print(f"[Offload] Error offloading file {file_id}: {str(e)}")
+        finally:
+            with queued_lock:
+                queued_ids.discard(file_id)
+
+
+def resume_pending_offloads(app):
+    """
+    Queue every pending file and remove orphaned spool files
+
+    Called at startup and by the scheduler, so files left pending by a
+    restart or a failed upload are eventually offloaded.
+
+    Returns:
+        int: Number of pending files found
+    """
+    with app.app_context():
+        pending = File.query.filter_by(storage_state='pending').all()
+        pending_paths = {file_record.filepath for file_record in pending}
+        for file_record in pending:
+            enqueue_offload(app, file_record.id)
+
+        if os.path.isdir(SPOOL_FOLDER):
+            cutoff = time.time() - ORPHAN_SPOOL_AGE_SECONDS
+            for name in os.listdir(SPOOL_FOLDER):
+                path = os.path.join(SPOOL_FOLDER, name)
+                if path not in pending_paths and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    print(f"[Offload] Removed orphaned spool file {name}")
+
+        return len(pending)
@@ -0,0 +1,160 @@
+"""
+Byte Range Downloads
+Resolves Range requests against a stored representation and builds 206
+responses, single part or multipart/byteranges, from any source that can
+read an arbitrary span of bytes (a seekable local file or a ranged S3 GET)
+"""
+from flask import request, Response
+from werkzeug.datastructures import ContentRange
+from config import DOWNLOAD_CHUNK_SIZE
+from s3_storage import stream_file_from_s3
+import uuid
+
+# Requests for more (non-adjacent) ranges than this are answered with one
+# range spanning all of them, which RFC 7233 allows
+MAX_RANGES = 16
+
+
+def requested_ranges(length, etag=None, last_modified=None):
+    """
+    Byte ranges a download request asks for
+
+    Ranges are clamped to the representation, sorted and coalesced. The
+    Range header is ignored when it can't be parsed or If-Range doesn't
+    match the current ETag or Last-Modified, so clients resuming a changed
+    file get all of it.
+
+    Args:
+        length: Size of the representation in bytes
+        etag: Strong ETag of the representation, if it has one
+        last_modified: Last-Modified of the representation, if it has one
+
+    Returns:
+        list: (start, stop) tuples with stop exclusive; None if the full
+        representation should be sent, empty if no range can be satisfied
+    """
+    # Parsed by hand: werkzeug's parser rejects overlapping or unordered
+    # ranges, which clients are allowed to send
+    units, _, spec = request.headers.get('Range', '').partition('=')
+    if units.strip().lower() != 'bytes':
+        return None
+
+    if_range = request.if_range
+    if if_range.etag is not None and if_range.etag != etag:
+        return None
+    if if_range.date is not None and if_range.date != last_modified:
+        return None
+
+    ranges = []
+    for part in spec.split(','):
+        first, dash, last = part.strip().partition('-')
+        if not (first or dash or last):
+            continue
+        if not dash or (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+        if not first:
+            if not last:
+                return None
+            start, stop = max(length - int(last), 0), length
+        else:
+            start = int(first)
+            if last and int(last) < start:
+                return None
+            stop = min(int(last) + 1, length) if last else length
+        if start < stop:
+            ranges.append((start, stop))
+    if not ranges:
+        return []
+
+    ranges.sort()
+    coalesced = [ranges[0]]
+    for start, stop in ranges[1:]:
+        if start <= coalesced[-1][1]:
+            coalesced[-1] = (coalesced[-1][0], max(coalesced[-1][1], stop))
+        else:
+            coalesced.append((start, stop))
+
+    if len(coalesced) > MAX_RANGES:
+        return [(coalesced[0][0], coalesced[-1][1])]
+    return coalesced
+
+
+def file_range_reader(path, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """Range reader over a local file, seeking to each range"""
+    def read_range(start, stop):
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = stop - start
+            while remaining:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+    return read_range
+
+
+def s3_range_reader(s3_key, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """Range reader over an S3 object, one ranged GET per range"""
+    def read_range(start, stop):
+        success, result = stream_file_from_s3(s3_key, chunk_size=chunk_size, byte_range=(start, stop))
+        if not success:
+            raise IOError(result)
+        chunks, _ = result
+        yield from chunks
+    return read_range
+
+
+def range_response(ranges, length, read_range, mimetype='application/octet-stream'):
+    """
+    Build a 206 response for satisfiable ranges
+
+    One range is sent as the body with Content-Range. Several are sent as
+    multipart/byteranges, each read only when the client gets to it.
+    Content-Length is exact in both cases.
+
+    Args:
+        ranges: Non-empty list from requested_ranges
+        length: Size of the representation in bytes
+        read_range: Callable (start, stop) returning an iterator of chunks
+        mimetype: Content type of the representation
+    """
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        response = Response(read_range(start, stop), status=206, mimetype=mimetype, direct_passthrough=True)
+        response.content_length = stop - start
+        response.content_range = ContentRange('bytes', start, stop, length)
+        return response
+
+    boundary = uuid.uuid4().hex
+    part_headers = [
+        (
+            f'--{boundary}\r\n'
+            f'Content-Type: {mimetype}\r\n'
+            f'Content-Range: bytes {start}-{stop - 1}/{length}\r\n\r\n'
+        ).encode()
+        for start, stop in ranges
+    ]
+    closing = f'--{boundary}--\r\n'.encode()
+
+    def body():
+        for (start, stop), part_header in zip(ranges, part_headers):
+            yield part_header
+            yield from read_range(start, stop)
+            yield b'\r\n'
+        yield closing
+
+    response = Response(body(), status=206, direct_passthrough=True)
+    response.content_type = f'multipart/byteranges; boundary={boundary}'
+    response.content_length = sum(
+        len(part_header) + (stop - start) + 2
+        for (start, stop), part_header in zip(ranges, part_headers)
+    ) + len(closing)
+    return response
+
+
+def range_not_satisfiable(length):
+    """416 response for a Range request none of whose ranges overlap the representation"""
+    response = Response(status=416)
+    response.content_range = ContentRange('bytes', None, None, length)
+    return response
@@ -0,0 +1,233 @@
+"""
+Resumable Upload Storage
+Stores chunks of resumable upload sessions and assembles them into the final
+file, either as parts of an S3 multipart upload or as local part files
+"""
+from models import db, UploadSession, UploadPart
+from config import USE_S3, UPLOAD_FOLDER, RESUMABLE_CHUNK_SIZE, RESUMABLE_SESSION_TTL_HOURS
+from s3_storage import (
+    create_multipart_upload_in_s3,
+    upload_part_to_s3,
+    complete_multipart_upload_in_s3,
+    abort_multipart_upload_in_s3,
+    stream_file_from_s3,
+    S3MultipartUpload
+)
+from blobs import store_staged_file, staging_storage_key, discard_staged_file, is_compressible
+from streaming import CompressingUpload
+from datetime import datetime, timedelta
+import hashlib
+import mimetypes
+import os
+import shutil
+import uuid
+
+# Local part files live here until the session is completed
+SESSIONS_FOLDER = os.path.join(UPLOAD_FOLDER, '.sessions')
+
+
+def create_upload_session(user_id, filename, file_size, expiry_days):
+    """
+    Start a resumable upload session
+
+    In S3 mode chunks become parts of a multipart upload to a staging key,
+    which is moved into the blob store once the upload is complete.
+
+    Args:
+        user_id: User ID
+        filename: Display name requested for the file
+        file_size: Declared total size in bytes
+        expiry_days: Expiry applied when the session is completed
+
+    Returns:
+        tuple: (success: bool, UploadSession or error_message: str)
+    """
+    session_id = uuid.uuid4().hex
+    upload_session = UploadSession(
+        id=session_id,
+        user_id=user_id,
+        filename=filename,
+        file_size=file_size,
+        chunk_size=RESUMABLE_CHUNK_SIZE,
+        expiry_days=expiry_days
+    )
+
+    if USE_S3:
+        s3_key = staging_storage_key()
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        success, result = create_multipart_upload_in_s3(s3_key, content_type)
+        if not success:
+            return False, result
+        upload_session.storage_key = s3_key
+        upload_session.s3_upload_id = result
+    else:
+        parts_dir = os.path.join(SESSIONS_FOLDER, session_id)
+        os.makedirs(parts_dir, exist_ok=True)
+        upload_session.storage_key = parts_dir
+
+    db.session.add(upload_session)
+    return True, upload_session
+
+
+def store_chunk(upload_session, part_number, data):
+    """
+    Store one chunk, replacing any earlier copy of the same chunk
+
+    Returns:
+        tuple: (success: bool, UploadPart or error_message: str)
+    """
+    etag = None
+    if upload_session.s3_upload_id:
+        success, result = upload_part_to_s3(
+            upload_session.storage_key, upload_session.s3_upload_id, part_number, data
+        )
+        if not success:
+            return False, result
+        etag = result
+    else:
+        part_path = os.path.join(upload_session.storage_key, f'{part_number}.part')
+        temp_path = f'{part_path}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, part_path)
+
+    part = UploadPart.query.get((upload_session.id, part_number))
+    if part is None:
+        part = UploadPart(session_id=upload_session.id, part_number=part_number)
+        db.session.add(part)
+    part.size = len(data)
+    part.etag = etag
+    return True, part
+
+
+def finish_upload_session(upload_session):
+    """
+    Assemble all stored chunks into the final file
+
+    Local part files are concatenated and hashed in one pass (and
+    compressed for eligible types); S3 sessions are completed under their
+    staging key and then hashed (see store_completed_s3_upload). Either
+    way the result goes into the blob store, so identical content is only
+    kept once. The caller commits the session.
+
+    Args:
+        upload_session: Session whose chunks have all been received
+
+    Returns:
+        tuple: (success: bool, Blob or error_message: str)
+    """
+    parts = sorted(upload_session.parts, key=lambda part: part.part_number)
+
+    if upload_session.s3_upload_id:
+        success, result = complete_multipart_upload_in_s3(
+            upload_session.storage_key,
+            upload_session.s3_upload_id,
+            [(part.part_number, part.etag) for part in parts]
+        )
+        if not success:
+            return False, result
+        return store_completed_s3_upload(upload_session)
+
+    try:
+        staged_key = staging_storage_key()
+        content_encoding = 'gzip' if is_compressible(upload_session.filename) else None
+        digest = hashlib.sha256()
+        with open(staged_key, 'wb') as staged_file:
+            output = CompressingUpload(staged_file) if content_encoding else staged_file
+            for part in parts:
+                part_path = os.path.join(upload_session.storage_key, f'{part.part_number}.part')
+                with open(part_path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                        digest.update(chunk)
+                        output.write(chunk)
+            if content_encoding:
+                output.flush()
+
+        success, result = store_staged_file(
+            staged_key, digest.hexdigest(), upload_session.file_size, content_encoding=content_encoding
+        )
+        if success:
+            shutil.rmtree(upload_session.storage_key, ignore_errors=True)
+        return success, result
+    except Exception as e:
+        return False, f"Upload error: {str(e)}"
+
+
+def store_completed_s3_upload(upload_session):
+    """
+    Hash a completed S3 session and move it into the blob store
+
+    Chunks reach S3 as multipart parts, possibly out of order and retried,
+    so the digest can only be taken once the object is whole: it is read
+    back in one streamed GET. Compressible types are gzipped into a second
+    staging object on the way and the uncompressed one is dropped.
+
+    Returns:
+        tuple: (success: bool, Blob or error_message: str)
+    """
+    staged_key = upload_session.storage_key
+    content_encoding = 'gzip' if is_compressible(upload_session.filename) else None
+    writer = None
+    try:
+        success, result = stream_file_from_s3(staged_key)
+        if not success:
+            return False, result
+        chunks, _ = result
+
+        if content_encoding:
+            content_type = mimetypes.guess_type(upload_session.filename)[0] or 'application/octet-stream'
+            writer = CompressingUpload(
+                S3MultipartUpload(staging_storage_key(), content_type, content_encoding=content_encoding)
+            )
+
+        digest = hashlib.sha256()
+        size = 0
+        for chunk in chunks:
+            digest.update(chunk)
+            size += len(chunk)
+            if writer:
+                writer.write(chunk)
+
+        if writer:
+            success, result = writer.complete()
+            writer = None
+            if not success:
+                discard_staged_file(staged_key)
+                return False, result
+            discard_staged_file(staged_key)
+            staged_key = result
+
+        return store_staged_file(staged_key, digest.hexdigest(), size, content_encoding=content_encoding)
+    except Exception as e:
+        if writer:
+            writer.abort()
+        discard_staged_file(staged_key)
+        return False, f"Upload error: {str(e)}"
+
+
+def discard_upload_session(upload_session):
+    """Free everything stored for a session and delete its row (caller commits)"""
+    if upload_session.s3_upload_id:
+        abort_multipart_upload_in_s3(upload_session.storage_key, upload_session.s3_upload_id)
+    else:
+        shutil.rmtree(upload_session.storage_key, ignore_errors=True)
+
+    db.session.delete(upload_session)
+
+
+def cleanup_stale_upload_sessions():
+    """Discard sessions abandoned for longer than RESUMABLE_SESSION_TTL_HOURS (needs app context)"""
+    cutoff = datetime.utcnow() - timedelta(hours=RESUMABLE_SESSION_TTL_HOURS)
+    stale_sessions = UploadSession.query.filter(UploadSession.created_at < cutoff).all()
+
+    for upload_session in stale_sessions:
+        discard_upload_session(upload_session)
+        print(f"[Uploads] Discarded stale upload session {upload_session.id} ({upload_session.filename})")
+
+    try:
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"[Uploads] Error discarding stale sessions: {str(e)}")
+
+    return len(stale_sessions)
@@ -3,6 +3,8 @@ S3 Storage Utility
 Handles file upload, download, and deletion from Amazon S3
 """
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError, NoCredentialsError
 from config import (
     USE_S3,
@@ -10,12 +12,40 @@ from config import (
     AWS_SECRET_ACCESS_KEY,
     AWS_REGION,
     S3_BUCKET_NAME,
-    S3_BUCKET_PREFIX
+    S3_BUCKET_PREFIX,
+    S3_MULTIPART_PART_SIZE,
+    S3_MULTIPART_THRESHOLD,
+    S3_MAX_CONCURRENCY,
+    S3_MAX_POOL_CONNECTIONS,
+    S3_USE_CRT,
+    PRESIGNED_GET_CACHE_FRACTION,
+    DOWNLOAD_CHUNK_SIZE
 )
+from concurrent.futures import ThreadPoolExecutor
+import base64
+import hashlib
+import mmap
 import os
+import tempfile
+import threading
+import time
+import uuid
 from werkzeug.utils import secure_filename
 from io import BytesIO
 
+# One connection pool shared by every request, sized for parallel part transfers
+client_config = Config(max_pool_connections=S3_MAX_POOL_CONNECTIONS)
+
+# Settings for managed transfers. Files below the threshold go up in a single
+# request on the calling thread; larger ones are split into parts sent in parallel.
+transfer_config = TransferConfig(
+    multipart_threshold=S3_MULTIPART_THRESHOLD,
+    multipart_chunksize=S3_MULTIPART_PART_SIZE,
+    max_concurrency=S3_MAX_CONCURRENCY,
+    use_threads=S3_MAX_CONCURRENCY > 1,
+    preferred_transfer_client='auto' if S3_USE_CRT else 'classic'
+)
+
 # Initialize S3 client
 s3_client = None
 if USE_S3:
@@ -25,11 +55,12 @@ if USE_S3:
                 's3',
                 aws_access_key_id=AWS_ACCESS_KEY_ID,
                 aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-                region_name=AWS_REGION
+                region_name=AWS_REGION,
+                config=client_config
             )
         else:
             # Try to use default credentials (from ~/.aws/credentials or IAM role)
-            s3_client = boto3.client('s3', region_name=AWS_REGION)
+            s3_client = boto3.client('s3', region_name=AWS_REGION, config=client_config)
         print("[S3] S3 client initialized successfully")
     except NoCredentialsError:
         print("[S3] Warning: AWS credentials not found. S3 functionality disabled.")
@@ -41,20 +72,99 @@ if USE_S3:
         USE_S3 = False
 
 
+class TransferMeter:
+    """
+    Progress callback measuring the throughput of a single transfer
+
+    Managed transfers call it from their worker threads with the number of
+    bytes moved since the last call.
+    """
+
+    def __init__(self):
+        self.bytes_transferred = 0
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def __call__(self, bytes_amount):
+        with self.lock:
+            self.bytes_transferred += bytes_amount
+
+    def summary(self):
+        """Human readable size, duration and rate of the transfer so far"""
+        elapsed = max(time.monotonic() - self.started, 0.001)
+        megabytes = self.bytes_transferred / (1024 * 1024)
+        return f"{megabytes:.2f}MB in {elapsed:.2f}s, {megabytes / elapsed:.2f}MB/s"
+
+
+def sha256_checksum(data):
+    """Base64 SHA-256 digest in the form S3 expects for ChecksumSHA256"""
+    return base64.b64encode(hashlib.sha256(data).digest()).decode('ascii')
+
+
+class HashingReader:
+    """
+    Seekable file wrapper computing the SHA-256 of the bytes read through it
+
+    Each byte is hashed the first time it is read, so re-reads after
+    seeking back (checksum passes, retries) don't corrupt the digest.
+    """
+
+    def __init__(self, file_obj):
+        self.file_obj = file_obj
+        self.hash = hashlib.sha256()
+        self.hashed_upto = file_obj.tell()
+
+    @property
+    def sha256(self):
+        return self.hash.hexdigest()
+
+    def read(self, size=-1):
+        position = self.file_obj.tell()
+        data = self.file_obj.read(size)
+        end = position + len(data)
+        if position <= self.hashed_upto < end:
+            self.hash.update(data[self.hashed_upto - position:])
+            self.hashed_upto = end
+        return data
+
+    def seek(self, offset, whence=0):
+        return self.file_obj.seek(offset, whence)
+
+    def tell(self):
+        return self.file_obj.tell()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        self.file_obj.close()
+
+
 def get_s3_key(user_id, filename):
     """Generate S3 key (path) for a file"""
     safe_filename = secure_filename(filename)
-    return f"{S3_BUCKET_PREFIX}/user_{user_id}/{safe_filename}"
+    return f"{get_user_s3_prefix(user_id)}{safe_filename}"
 
 
-def upload_file_to_s3(file_obj, user_id, filename):
+def upload_file_to_s3(file_obj, user_id, filename, s3_key=None, content_encoding=None, expected_sha256=None):
     """
     Upload a file to S3
     
+    S3 verifies a SHA-256 checksum of every request body, and the digest
+    of the whole file is computed as it is read for the upload. If it
+    doesn't match expected_sha256 (the file changed after it was hashed)
+    the object is deleted again.
+    
     Args:
         file_obj: File-like object (from Flask request.files)
         user_id: User ID
         filename: Original filename
+        s3_key: Destination key (defaults to get_s3_key(user_id, filename))
+        content_encoding: Content-Encoding stored with the object (e.g. 'gzip')
+        expected_sha256: Hex SHA-256 the uploaded bytes must have
     
     Returns:
         tuple: (success: bool, s3_key: str or error_message: str)
@@ -66,7 +176,7 @@ def upload_file_to_s3(file_obj, user_id, filename):
         return False, "S3 bucket name not configured"
     
     try:
-        s3_key = get_s3_key(user_id, filename)
+        s3_key = s3_key or get_s3_key(user_id, filename)
         
         # Reset file pointer to beginning
         file_obj.seek(0)
@@ -83,14 +193,28 @@ def upload_file_to_s3(file_obj, user_id, filename):
             if guessed_type:
                 content_type = guessed_type
         
+        extra_args = {'ContentType': content_type, 'ChecksumAlgorithm': 'SHA256'}
+        if content_encoding:
+            extra_args['ContentEncoding'] = content_encoding
+        
+        reader = HashingReader(file_obj)
+        meter = TransferMeter()
         s3_client.upload_fileobj(
-            file_obj,
+            reader,
             S3_BUCKET_NAME,
             s3_key,
-            ExtraArgs={'ContentType': content_type}
+            ExtraArgs=extra_args,
+            Callback=meter,
+            Config=transfer_config
         )
         
-        print(f"[S3] File uploaded: {s3_key}")
+        if expected_sha256 and reader.sha256 != expected_sha256:
+            s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=s3_key)
+            error_msg = f"Checksum mismatch for {s3_key}: file changed during upload"
+            print(f"[S3] Upload failed: {error_msg}")
+            return False, error_msg
+        
+        print(f"[S3] File uploaded: {s3_key} (sha256 {reader.sha256[:12]}, {meter.summary()})")
         return True, s3_key
     
     except ClientError as e:
@@ -103,13 +227,234 @@ def upload_file_to_s3(file_obj, user_id, filename):
         return False, error_msg
 
 
-def download_file_from_s3(user_id, filename):
+class S3MultipartUpload:
+    """
+    Incrementally upload a stream of bytes to S3
+
+    Data passed to write() is buffered until a full part is available and
+    then sent with upload_part, so memory stays bounded by the part size no
+    matter how large the object is. Objects smaller than one part are sent
+    with a single put_object instead. Every part carries a SHA-256 checksum
+    that S3 verifies.
+    """
+
+    def __init__(self, s3_key, content_type='application/octet-stream', part_size=S3_MULTIPART_PART_SIZE,
+                 content_encoding=None):
+        self.s3_key = s3_key
+        self.content_type = content_type
+        self.content_encoding = content_encoding
+        self.part_size = part_size
+        self.upload_id = None
+        self.parts = []
+        self.buffer = bytearray()
+        self.bytes_written = 0
+        self.meter = TransferMeter()
+
+    def write(self, data):
+        """Buffer data and flush every complete part to S3"""
+        self.buffer += data
+        self.bytes_written += len(data)
+        while len(self.buffer) >= self.part_size:
+            self._upload_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+
+    def _object_args(self):
+        """Headers stored with the final object"""
+        args = {'ContentType': self.content_type}
+        if self.content_encoding:
+            args['ContentEncoding'] = self.content_encoding
+        return args
+
+    def _upload_part(self, body):
+        if self.upload_id is None:
+            response = s3_client.create_multipart_upload(
+                Bucket=S3_BUCKET_NAME,
+                Key=self.s3_key,
+                ChecksumAlgorithm='SHA256',
+                **self._object_args()
+            )
+            self.upload_id = response['UploadId']
+        
+        part_number = len(self.parts) + 1
+        checksum = sha256_checksum(body)
+        response = s3_client.upload_part(
+            Bucket=S3_BUCKET_NAME,
+            Key=self.s3_key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=body,
+            ChecksumSHA256=checksum
+        )
+        self.meter(len(body))
+        self.parts.append({'PartNumber': part_number, 'ETag': response['ETag'], 'ChecksumSHA256': checksum})
+
+    def complete(self):
+        """
+        Flush remaining data and finish the upload
+        
+        Returns:
+            tuple: (success: bool, s3_key: str or error_message: str)
+        """
+        try:
+            if self.upload_id is None:
+                # Whole object fits in one part
+                s3_client.put_object(
+                    Bucket=S3_BUCKET_NAME,
+                    Key=self.s3_key,
+                    Body=bytes(self.buffer),
+                    ChecksumSHA256=sha256_checksum(self.buffer),
+                    **self._object_args()
+                )
+                self.meter(len(self.buffer))
+            else:
+                if self.buffer:
+                    self._upload_part(bytes(self.buffer))
+                s3_client.complete_multipart_upload(
+                    Bucket=S3_BUCKET_NAME,
+                    Key=self.s3_key,
+                    UploadId=self.upload_id,
+                    MultipartUpload={'Parts': self.parts}
+                )
+            self.buffer.clear()
+            
+            print(f"[S3] File uploaded: {self.s3_key} ({len(self.parts) or 1} part(s), {self.meter.summary()})")
+            return True, self.s3_key
+        
+        except ClientError as e:
+            self.abort()
+            error_msg = f"AWS S3 error: {str(e)}"
+            print(f"[S3] Upload failed: {error_msg}")
+            return False, error_msg
+        except Exception as e:
+            self.abort()
+            error_msg = f"Upload error: {str(e)}"
+            print(f"[S3] Upload failed: {error_msg}")
+            return False, error_msg
+
+    def abort(self):
+        """Discard buffered data and any parts already sent to S3"""
+        self.buffer.clear()
+        if self.upload_id is None:
+            return
+        
+        try:
+            s3_client.abort_multipart_upload(
+                Bucket=S3_BUCKET_NAME,
+                Key=self.s3_key,
+                UploadId=self.upload_id
+            )
+            print(f"[S3] Multipart upload aborted: {self.s3_key}")
+        except Exception as e:
+            print(f"[S3] Failed to abort multipart upload {self.s3_key}: {str(e)}")
+        self.upload_id = None
+
+
+def create_multipart_upload_in_s3(s3_key, content_type='application/octet-stream'):
+    """
+    Start an S3 multipart upload whose parts can be sent in any order
+    
+    Args:
+        s3_key: S3 key of the final object
+        content_type: Content-Type of the final object
+    
+    Returns:
+        tuple: (success: bool, upload_id: str or error_message: str)
+    """
+    if not USE_S3 or not s3_client:
+        return False, "S3 not configured"
+    
+    if not S3_BUCKET_NAME:
+        return False, "S3 bucket name not configured"
+    
+    try:
+        response = s3_client.create_multipart_upload(
+            Bucket=S3_BUCKET_NAME,
+            Key=s3_key,
+            ContentType=content_type
+        )
+        return True, response['UploadId']
+    except Exception as e:
+        error_msg = f"AWS S3 error: {str(e)}"
+        print(f"[S3] Multipart upload start failed: {error_msg}")
+        return False, error_msg
+
+
+def upload_part_to_s3(s3_key, upload_id, part_number, body):
+    """
+    Upload (or replace) one part of a multipart upload
+    
+    Returns:
+        tuple: (success: bool, etag: str or error_message: str)
+    """
+    try:
+        response = s3_client.upload_part(
+            Bucket=S3_BUCKET_NAME,
+            Key=s3_key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=body
+        )
+        return True, response['ETag']
+    except Exception as e:
+        error_msg = f"AWS S3 error: {str(e)}"
+        print(f"[S3] Part {part_number} upload failed: {error_msg}")
+        return False, error_msg
+
+
+def complete_multipart_upload_in_s3(s3_key, upload_id, parts):
+    """
+    Assemble uploaded parts into the final object
+    
+    Args:
+        s3_key: S3 key of the final object
+        upload_id: Multipart upload ID
+        parts: List of (part_number, etag) tuples
+    
+    Returns:
+        tuple: (success: bool, s3_key: str or error_message: str)
+    """
+    try:
+        s3_client.complete_multipart_upload(
+            Bucket=S3_BUCKET_NAME,
+            Key=s3_key,
+            UploadId=upload_id,
+            MultipartUpload={
+                'Parts': [{'PartNumber': number, 'ETag': etag} for number, etag in sorted(parts)]
+            }
+        )
+        print(f"[S3] File uploaded: {s3_key} ({len(parts)} part(s))")
+        return True, s3_key
+    except Exception as e:
+        error_msg = f"AWS S3 error: {str(e)}"
+        print(f"[S3] Multipart upload completion failed: {error_msg}")
+        return False, error_msg
+
+
+def abort_multipart_upload_in_s3(s3_key, upload_id):
+    """
+    Abort a multipart upload and free its stored parts
+    
+    Returns:
+        tuple: (success: bool, message: str)
+    """
+    try:
+        s3_client.abort_multipart_upload(Bucket=S3_BUCKET_NAME, Key=s3_key, UploadId=upload_id)
+        print(f"[S3] Multipart upload aborted: {s3_key}")
+        return True, "Multipart upload aborted"
+    except Exception as e:
+        error_msg = f"AWS S3 error: {str(e)}"
+        print(f"[S3] Failed to abort multipart upload {s3_key}: {error_msg}")
+        return False, error_msg
+
+
+def download_file_from_s3(user_id, filename, s3_key=None):
     """
     Download a file from S3
     
     Args:
         user_id: User ID
         filename: Filename
+        s3_key: Stored key (defaults to get_s3_key(user_id, filename))
     
     Returns:
         tuple: (success: bool, file_data: BytesIO or error_message: str)
@@ -121,14 +466,21 @@ def download_file_from_s3(user_id, filename):
         return False, "S3 bucket name not configured"
     
     try:
-        s3_key = get_s3_key(user_id, filename)
+        s3_key = s3_key or get_s3_key(user_id, filename)
         
         # Download from S3
         file_obj = BytesIO()
-        s3_client.download_fileobj(S3_BUCKET_NAME, s3_key, file_obj)
+        meter = TransferMeter()
+        s3_client.download_fileobj(
+            S3_BUCKET_NAME,
+            s3_key,
+            file_obj,
+            Callback=meter,
+            Config=transfer_config
+        )
         file_obj.seek(0)
         
-        print(f"[S3] File downloaded: {s3_key}")
+        print(f"[S3] File downloaded: {s3_key} ({meter.summary()})")
         return True, file_obj
     
     except ClientError as e:
@@ -144,13 +496,156 @@ def download_file_from_s3(user_id, filename):
         return False, error_msg
 
 
-def delete_file_from_s3(user_id, filename):
+def stream_file_from_s3(s3_key, chunk_size=DOWNLOAD_CHUNK_SIZE, byte_range=None):
+    """
+    Open an S3 object for streaming instead of downloading it into memory
+    
+    The returned iterator reads the get_object body one chunk at a time,
+    so only a single chunk is held in memory, and closes the connection
+    when exhausted or closed early.
+    
+    Args:
+        s3_key: Key of the object
+        chunk_size: Bytes yielded at a time
+        byte_range: Optional (start, stop) to fetch only those bytes (stop exclusive)
+    
+    Returns:
+        tuple: (success: bool, (chunks: iterator, content_length: int) or error_message: str)
+    """
+    if not USE_S3 or not s3_client:
+        return False, "S3 not configured"
+    
+    get_args = {'Bucket': S3_BUCKET_NAME, 'Key': s3_key}
+    if byte_range:
+        get_args['Range'] = f'bytes={byte_range[0]}-{byte_range[1] - 1}'
+    
+    try:
+        response = s3_client.get_object(**get_args)
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchKey':
+            error_msg = "File not found in S3"
+        else:
+            error_msg = f"AWS S3 error: {str(e)}"
+        print(f"[S3] Download failed: {error_msg}")
+        return False, error_msg
+    except Exception as e:
+        error_msg = f"Download error: {str(e)}"
+        print(f"[S3] Download failed: {error_msg}")
+        return False, error_msg
+    
+    body = response['Body']
+    
+    def chunks():
+        meter = TransferMeter()
+        try:
+            for chunk in body.iter_chunks(chunk_size):
+                meter(len(chunk))
+                yield chunk
+            print(f"[S3] File streamed: {s3_key} ({meter.summary()})")
+        finally:
+            body.close()
+    
+    return True, (chunks(), response['ContentLength'])
+
+
+def fetch_file_from_s3_parallel(s3_key, part_size=S3_MULTIPART_PART_SIZE, max_workers=S3_MAX_CONCURRENCY,
+                                directory=None):
+    """
+    Download a large object to a local file with concurrent ranged GETs
+    
+    The object is split into part_size ranges that are fetched in parallel,
+    each read in DOWNLOAD_CHUNK_SIZE chunks that are copied into its slice
+    of a preallocated, memory-mapped temp file. Multi-hundred-MB objects
+    transfer at full bandwidth with one chunk per range in memory, and are
+    never assembled in Python. Every range is pinned to the ETag seen up
+    front, so an object replaced mid-transfer fails instead of mixing
+    versions.
+    
+    Args:
+        s3_key: Key of the object
+        part_size: Bytes fetched per ranged GET
+        max_workers: Ranges fetched at the same time
+        directory: Where to create the file (system temp dir by default)
+    
+    Returns:
+        tuple: (success: bool, local path or error_message: str)
+        The caller removes the file when done with it.
+    """
+    if not USE_S3 or not s3_client:
+        return False, "S3 not configured"
+    
+    success, result = head_object_in_s3(s3_key)
+    if not success:
+        return False, result
+    size = result['ContentLength']
+    etag = result['ETag']
+    
+    ranges = [(start, min(start + part_size, size)) for start in range(0, size, part_size)]
+    fd, path = tempfile.mkstemp(prefix='s3-fetch-', suffix='.tmp', dir=directory)
+    meter = TransferMeter()
+    try:
+        with os.fdopen(fd, 'r+b') as f:
+            if ranges:
+                f.truncate(size)
+                with mmap.mmap(f.fileno(), size) as mapped, memoryview(mapped) as view:
+                    with ThreadPoolExecutor(max_workers=min(max_workers, len(ranges))) as executor:
+                        futures = [
+                            executor.submit(_read_range_into, s3_key, etag, view, start, stop, meter)
+                            for start, stop in ranges
+                        ]
+                        for future in futures:
+                            future.result()
+                    mapped.flush()
+        
+        print(f"[S3] File fetched in {len(ranges)} range(s): {s3_key} ({meter.summary()})")
+        return True, path
+    
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', 'PreconditionFailed'):
+            error_msg = "File not found in S3 or changed during download"
+        else:
+            error_msg = f"AWS S3 error: {str(e)}"
+    except Exception as e:
+        error_msg = f"Download error: {str(e)}"
+    
+    os.remove(path)
+    print(f"[S3] Parallel fetch failed: {error_msg}")
+    return False, error_msg
+
+
+def _read_range_into(s3_key, etag, view, start, stop, meter):
+    """
+    Fetch one byte range of an object into view[start:stop]
+
+    The body is read through its public chunk iterator, so botocore still
+    checks the received length against Content-Length.
+    """
+    response = s3_client.get_object(
+        Bucket=S3_BUCKET_NAME, Key=s3_key, Range=f'bytes={start}-{stop - 1}', IfMatch=etag
+    )
+    body = response['Body']
+    try:
+        position = start
+        for chunk in body.iter_chunks(DOWNLOAD_CHUNK_SIZE):
+            if position + len(chunk) > stop:
+                raise IOError(f"Range at offset {start} returned more than {stop - start} bytes")
+            view[position:position + len(chunk)] = chunk
+            position += len(chunk)
+            meter(len(chunk))
+        if position != stop:
+            raise IOError(f"Connection closed after {position - start} of {stop - start} bytes at offset {start}")
+    finally:
+        body.close()
+
+
+def delete_file_from_s3(user_id, filename, s3_key=None):
     """
     Delete a file from S3
     
     Args:
         user_id: User ID
         filename: Filename
+        s3_key: Stored key (defaults to get_s3_key(user_id, filename))
     
     Returns:
         tuple: (success: bool, message: str)
@@ -162,7 +657,7 @@ def delete_file_from_s3(user_id, filename):
         return False, "S3 bucket name not configured"
     
     try:
-        s3_key = get_s3_key(user_id, filename)
+        s3_key = s3_key or get_s3_key(user_id, filename)
         
         # Delete from S3
         s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=s3_key)
@@ -180,6 +675,53 @@ def delete_file_from_s3(user_id, filename):
         return False, error_msg
 
 
+def move_object_in_s3(source_key, dest_key):
+    """
+    Move an object to a new key with a server-side copy
+    
+    The source's Content-Type, Content-Encoding and user metadata are
+    passed on explicitly, and S3 is asked for a fresh SHA-256 checksum of
+    the copy: above the multipart threshold the managed copy creates a new
+    multipart upload, which would otherwise carry none of them.
+    
+    Args:
+        source_key: Current S3 key
+        dest_key: New S3 key
+    
+    Returns:
+        tuple: (success: bool, dest_key: str or error_message: str)
+    """
+    if not USE_S3 or not s3_client:
+        return False, "S3 not configured"
+    
+    try:
+        head = s3_client.head_object(Bucket=S3_BUCKET_NAME, Key=source_key)
+        extra_args = {
+            'ContentType': head.get('ContentType', 'binary/octet-stream'),
+            'Metadata': head.get('Metadata', {}),
+            'MetadataDirective': 'REPLACE',
+            'ChecksumAlgorithm': 'SHA256'
+        }
+        if head.get('ContentEncoding'):
+            extra_args['ContentEncoding'] = head['ContentEncoding']
+        
+        # Managed copy switches to parallel multipart copy for large objects
+        s3_client.copy(
+            {'Bucket': S3_BUCKET_NAME, 'Key': source_key},
+            S3_BUCKET_NAME,
+            dest_key,
+            ExtraArgs=extra_args,
+            Config=transfer_config
+        )
+        s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=source_key)
+        print(f"[S3] File moved: {source_key} -> {dest_key}")
+        return True, dest_key
+    except Exception as e:
+        error_msg = f"AWS S3 error: {str(e)}"
+        print(f"[S3] Move failed: {error_msg}")
+        return False, error_msg
+
+
 def file_exists_in_s3(user_id, filename):
     """
     Check if a file exists in S3
@@ -209,25 +751,142 @@ def file_exists_in_s3(user_id, filename):
         return False
 
 
-def ensure_unique_filename_in_s3(user_id, filename):
+def new_object_key(user_id):
+    """Generate an opaque S3 key for a new object, independent of its display name"""
+    return f"{get_user_s3_prefix(user_id)}{uuid.uuid4().hex}"
+
+
+def get_user_s3_prefix(user_id):
+    """Key prefix under which all of a user's objects are stored"""
+    return f"{S3_BUCKET_PREFIX}/user_{user_id}/"
+
+
+def generate_presigned_upload(s3_key, max_size, content_type, expires_in):
     """
-    Ensure filename is unique in S3 by appending counter if needed
+    Generate a presigned POST policy so a browser can upload straight to S3
+    
+    The policy pins the exact key, limits the body to max_size bytes and
+    fixes the Content-Type, so S3 itself rejects anything else.
     
     Args:
-        user_id: User ID
-        filename: Original filename
+        s3_key: Key the object must be uploaded to
+        max_size: Maximum object size in bytes
+        content_type: Content-Type the browser must send
+        expires_in: Policy lifetime in seconds
     
     Returns:
-        str: Unique filename
+        tuple: (success: bool, {'url', 'fields'} dict or error_message: str)
     """
-    if not file_exists_in_s3(user_id, filename):
-        return filename
+    if not USE_S3 or not s3_client:
+        return False, "S3 not configured"
     
-    base_name, ext = os.path.splitext(filename)
-    counter = 1
-    while True:
-        new_filename = f"{base_name}_{counter}{ext}"
-        if not file_exists_in_s3(user_id, new_filename):
-            return new_filename
-        counter += 1
+    if not S3_BUCKET_NAME:
+        return False, "S3 bucket name not configured"
+    
+    try:
+        key_prefix = s3_key.rsplit('/', 1)[0] + '/'
+        presigned = s3_client.generate_presigned_post(
+            Bucket=S3_BUCKET_NAME,
+            Key=s3_key,
+            Fields={'Content-Type': content_type},
+            Conditions=[
+                ['content-length-range', 0, max_size],
+                ['starts-with', '$key', key_prefix],
+                {'Content-Type': content_type}
+            ],
+            ExpiresIn=expires_in
+        )
+        return True, presigned
+    
+    except Exception as e:
+        error_msg = f"Presign error: {str(e)}"
+        print(f"[S3] Presign failed: {error_msg}")
+        return False, error_msg
 
+
+# Signed download URLs by (s3_key, download_name, expires_in): (url, reuse_until)
+presigned_download_cache = {}
+presigned_download_lock = threading.Lock()
+PRESIGNED_DOWNLOAD_CACHE_SIZE = 4096
+
+
+def generate_presigned_download(s3_key, download_name, content_type, expires_in):
+    """
+    Get a presigned GET URL that downloads an object as an attachment
+    
+    S3 sends the Content-Disposition and Content-Type given here. URLs
+    are cached and handed out again for PRESIGNED_GET_CACHE_FRACTION of
+    their lifetime, so clients always get at least the rest to use them.
+    
+    Args:
+        s3_key: Key of the object
+        download_name: Filename the browser saves the download as
+        content_type: Content-Type S3 should respond with
+        expires_in: URL lifetime in seconds
+    
+    Returns:
+        tuple: (success: bool, url: str or error_message: str)
+    """
+    if not USE_S3 or not s3_client:
+        return False, "S3 not configured"
+    
+    cache_key = (s3_key, download_name, expires_in)
+    now = time.monotonic()
+    with presigned_download_lock:
+        cached = presigned_download_cache.get(cache_key)
+        if cached and cached[1] > now:
+            return True, cached[0]
+    
+    try:
+        url = s3_client.generate_presigned_url(
+            'get_object',
+            Params={
+                'Bucket': S3_BUCKET_NAME,
+                'Key': s3_key,
+                'ResponseContentDisposition': f'attachment; filename="{download_name}"',
+                'ResponseContentType': content_type
+            },
+            ExpiresIn=expires_in
+        )
+    except Exception as e:
+        error_msg = f"Presign error: {str(e)}"
+        print(f"[S3] Presign failed: {error_msg}")
+        return False, error_msg
+    
+    with presigned_download_lock:
+        if len(presigned_download_cache) >= PRESIGNED_DOWNLOAD_CACHE_SIZE:
+            # Drop entries that can't be reused anymore, or everything if none have lapsed
+            expired = [key for key, (_, reuse_until) in presigned_download_cache.items() if reuse_until <= now]
+            for key in expired or list(presigned_download_cache):
+                del presigned_download_cache[key]
+        presigned_download_cache[cache_key] = (url, now + expires_in * PRESIGNED_GET_CACHE_FRACTION)
+    
+    return True, url
+
+
+def head_object_in_s3(s3_key):
+    """
+    Fetch an object's metadata with a single HEAD request
+    
+    Args:
+        s3_key: S3 key
+    
+    Returns:
+        tuple: (success: bool, head_object response dict or error_message: str)
+    """
+    if not USE_S3 or not s3_client:
+        return False, "S3 not configured"
+    
+    if not S3_BUCKET_NAME:
+        return False, "S3 bucket name not configured"
+    
+    try:
+        return True, s3_client.head_object(Bucket=S3_BUCKET_NAME, Key=s3_key)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+            error_msg = "File not found in S3"
+        else:
+            error_msg = f"AWS S3 error: {str(e)}"
+        return False, error_msg
+    except Exception as e:
+        return False, f"S3 error: {str(e)}"
@@ -8,17 +8,24 @@ from config import (
     SMTP_USERNAME,
     SMTP_PASSWORD,
     EMAIL_FROM,
-    USE_S3
+    USE_S3,
+    ASYNC_S3_OFFLOAD
 )
-from s3_storage import delete_file_from_s3
+from object_cache import CACHE_ENABLED, cache_stats
+from blobs import delete_stored_file
+from usage import file_removed
+from events import queue_event
+from listing import file_status
+from resumable import cleanup_stale_upload_sessions
+from offload import resume_pending_offloads
 from datetime import datetime, timedelta
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-import os
 
 scheduler = BackgroundScheduler()
 app = None  # Will be set from app.py
+last_pass_time = None  # When the previous pass committed; files entering the expiring window since then get an event
 
 
 def send_email_notification(user_email, filename, expiry_time):
@@ -65,6 +72,7 @@ AutoVault System
 
 def process_expired_files():
     """Check and process expired files"""
+    global last_pass_time
     if app is None:
         print("[Scheduler] App context not available")
         return
@@ -85,28 +93,32 @@ def process_expired_files():
             try:
                 # Check if file has expired
                 if file.is_expired():
-                    # Delete expired file
-                    if USE_S3:
-                        # Delete from S3
-                        success, message = delete_file_from_s3(file.user_id, file.filename)
-                        if not success:
-                            print(f"[Scheduler] Failed to delete from S3: {message}")
-                    else:
-                        # Delete from local filesystem
-                        if os.path.exists(file.filepath):
-                            os.remove(file.filepath)
+                    # Delete expired file (shared blobs are kept until their last file goes)
+                    success, message = delete_stored_file(file)
+                    if not success:
+                        storage_type = "S3" if USE_S3 else "local storage"
+                        print(f"[Scheduler] Failed to delete from {storage_type}: {message}")
                     
                     db.session.delete(file)
+                    file_removed(file)
+                    queue_event(file.user_id, 'file_expired', {'id': file.id})
                     deleted_count += 1
                     print(f"[Scheduler] Deleted expired file: {file.filename} (ID: {file.id})")
                 
-                # Check if notification should be sent
-                elif not file.email_sent and file.expiry_time <= notification_threshold:
-                    # Send notification
-                    user_email = file.user.email
-                    if send_email_notification(user_email, file.filename, file.expiry_time):
-                        file.email_sent = True
-                        notified_count += 1
+                else:
+                    # Tell open dashboards about files that entered the expiring window since the last pass
+                    if file_status(file.expiry_time, now) == 'expiring' and (
+                        last_pass_time is None or file_status(file.expiry_time, last_pass_time) == 'active'
+                    ):
+                        queue_event(file.user_id, 'file_expiring', {'id': file.id})
+                    
+                    # Check if notification should be sent
+                    if not file.email_sent and file.expiry_time <= notification_threshold:
+                        # Send notification
+                        user_email = file.user.email
+                        if send_email_notification(user_email, file.filename, file.expiry_time):
+                            file.email_sent = True
+                            notified_count += 1
             
             except Exception as e:
                 print(f"[Scheduler] Error processing file {file.id}: {str(e)}")
@@ -115,11 +127,26 @@ def process_expired_files():
         # Commit all changes
         try:
             db.session.commit()
+            last_pass_time = now
             if deleted_count > 0 or notified_count > 0:
                 print(f"[Scheduler] Processed: {deleted_count} deleted, {notified_count} notified")
         except Exception as e:
             db.session.rollback()
             print(f"[Scheduler] Error committing changes: {str(e)}")
+        
+        # Free chunks of abandoned resumable uploads
+        cleanup_stale_upload_sessions()
+        
+        # Retry spooled uploads whose offload failed
+        if USE_S3 and ASYNC_S3_OFFLOAD:
+            resume_pending_offloads(app)
+        
+        if CACHE_ENABLED:
+            stats = cache_stats()
+            print(
+                f"[Cache] {stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions, "
+                f"{stats['entries']} objects, {stats['bytes'] / (1024*1024):.2f}MB"
+            )
 
 
 def start_scheduler(flask_app=None):
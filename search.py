@@ -0,0 +1,107 @@
+"""
+Filename Search
+Prefix and substring matching on a user's file names, answered from an
+index instead of a scan of every file: a pg_trgm GIN index on the
+lowercased name (plus a per-user prefix index) on PostgreSQL, and an FTS5
+trigram table kept in sync by triggers on SQLite.
+"""
+from models import db, File
+from sqlalchemy import and_, column, func, text
+
+# Terms shorter than a trigram can't use the index and are matched by
+# scanning the user's own files
+MIN_INDEXED_TERM_LENGTH = 3
+
+POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_files_filename_trgm ON files USING gin (lower(filename) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_files_user_filename_prefix ON files (user_id, lower(filename) text_pattern_ops)",
+]
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5("
+    "filename, content='files', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS files_fts_insert AFTER INSERT ON files BEGIN "
+    "INSERT INTO files_fts (rowid, filename) VALUES (new.id, new.filename); END",
+    "CREATE TRIGGER IF NOT EXISTS files_fts_delete AFTER DELETE ON files BEGIN "
+    "INSERT INTO files_fts (files_fts, rowid, filename) VALUES ('delete', old.id, old.filename); END",
+    "CREATE TRIGGER IF NOT EXISTS files_fts_update AFTER UPDATE OF filename ON files BEGIN "
+    "INSERT INTO files_fts (files_fts, rowid, filename) VALUES ('delete', old.id, old.filename); "
+    "INSERT INTO files_fts (rowid, filename) VALUES (new.id, new.filename); END",
+]
+
+fts_tables = {}  # Database URL -> whether files_fts exists
+
+
+def init_search_index():
+    """
+    Create the filename index for the current database if it is missing
+
+    Called by init_db after the tables exist. Existing files are indexed
+    when the SQLite FTS table is first created. Without the index (e.g.
+    pg_trgm can't be installed) search still works, by scanning.
+    """
+    dialect = db.engine.dialect.name
+    try:
+        with db.engine.begin() as connection:
+            if dialect == 'postgresql':
+                for statement in POSTGRES_DDL:
+                    connection.execute(text(statement))
+            elif dialect == 'sqlite':
+                created = not has_fts_table(connection)
+                for statement in SQLITE_DDL:
+                    connection.execute(text(statement))
+                if created:
+                    connection.execute(text("INSERT INTO files_fts (files_fts) VALUES ('rebuild')"))
+            else:
+                return
+        fts_tables.pop(str(db.engine.url), None)
+        print(f"[Search] Filename index ready ({dialect})")
+    except Exception as e:
+        print(f"[Search] Could not create filename index, search will scan: {str(e)}")
+
+
+def has_fts_table(connection):
+    return connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'files_fts'")
+    ).first() is not None
+
+
+def fts_available():
+    """Whether the SQLite FTS table exists (looked up once per database)"""
+    url = str(db.engine.url)
+    if url not in fts_tables:
+        with db.engine.connect() as connection:
+            fts_tables[url] = has_fts_table(connection)
+    return fts_tables[url]
+
+
+def escape_like(term):
+    """Escape LIKE wildcards so the term matches literally (escape character is a backslash)"""
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def filename_filter(term, prefix=False):
+    """
+    Filter on File.filename for a case-insensitive search term
+
+    On SQLite, terms of a trigram or longer are looked up in the FTS table
+    as a phrase (an exact substring), and the LIKE then only confirms the
+    few candidates, e.g. that they start with the term for prefix searches.
+
+    Args:
+        term: Text to look for
+        prefix: Match names starting with the term instead of containing it
+    """
+    pattern = escape_like(term.lower()) + '%'
+    if not prefix:
+        pattern = '%' + pattern
+    matches = func.lower(File.filename).like(pattern, escape='\\')
+
+    if db.engine.dialect.name == 'sqlite' and len(term) >= MIN_INDEXED_TERM_LENGTH and fts_available():
+        phrase = '"' + term.replace('"', '""') + '"'
+        candidates = text(
+            "SELECT rowid FROM files_fts WHERE files_fts MATCH :phrase"
+        ).bindparams(phrase=phrase).columns(column('rowid'))
+        return and_(File.id.in_(candidates), matches)
+    return matches
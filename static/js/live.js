@@ -0,0 +1,203 @@
+// Live dashboard updates: file changes arrive as Server-Sent Events and are
+// patched into the table in place instead of reloading the page
+document.addEventListener('DOMContentLoaded', function() {
+    const section = document.getElementById('filesSection');
+    if (!section || !section.dataset.eventsUrl || !window.EventSource) {
+        return;
+    }
+
+    let listingVersion = parseInt(section.dataset.listingVersion);
+    const source = new EventSource(section.dataset.eventsUrl);
+
+    source.addEventListener('open', function() {
+        window.liveUpdatesConnected = true;
+    });
+    source.addEventListener('error', function() {
+        window.liveUpdatesConnected = false;
+    });
+
+    // Sent on every (re)connect; a different version means events were missed
+    source.addEventListener('hello', function(e) {
+        if (JSON.parse(e.data).version !== listingVersion) {
+            window.location.reload();
+        }
+    });
+    source.addEventListener('resync', function() {
+        window.location.reload();
+    });
+
+    source.addEventListener('file_added', function(e) {
+        const data = applyUsage(e);
+        const table = section.querySelector('.files-table table');
+        if (!table) {
+            // First file: the table itself has to be rendered
+            window.location.reload();
+            return;
+        }
+        // New files belong on the first page only
+        if (table.dataset.firstPage === 'true' && !findRow(data.file.id)) {
+            table.querySelector('tbody').prepend(buildRow(data.file));
+        }
+    });
+
+    source.addEventListener('file_updated', function(e) {
+        const data = applyUsage(e);
+        const row = findRow(data.file.id);
+        if (row) {
+            row.replaceWith(buildRow(data.file));
+        }
+    });
+
+    source.addEventListener('file_expiring', function(e) {
+        const data = applyUsage(e);
+        const row = findRow(data.id);
+        if (row) {
+            row.querySelector('.badge').replaceWith(statusBadge('expiring'));
+        }
+    });
+
+    ['file_removed', 'file_expired'].forEach(function(name) {
+        source.addEventListener(name, function(e) {
+            const data = applyUsage(e);
+            const row = findRow(data.id);
+            if (row) {
+                row.remove();
+            }
+        });
+    });
+
+    // Update the usage summary and remember how far the listing has got
+    function applyUsage(e) {
+        const data = JSON.parse(e.data);
+        const usage = data.usage;
+        listingVersion = usage.version;
+
+        const summary = document.querySelector('.usage-summary');
+        let text = usage.file_count + ' file(s) · ' + (usage.total_bytes / (1024 * 1024)).toFixed(2) + ' MB used';
+        if (usage.expiring_count) {
+            text += ' · ' + usage.expiring_count + ' expiring soon';
+        }
+        summary.textContent = text;
+        return data;
+    }
+
+    function findRow(fileId) {
+        return section.querySelector('tr[data-file-id="' + fileId + '"]');
+    }
+
+    function statusBadge(status) {
+        const badges = {
+            expired: ['badge-danger', 'Expired'],
+            expiring: ['badge-warning', 'Expiring Soon'],
+            active: ['badge-success', 'Active']
+        };
+        return badge(badges[status][0], badges[status][1]);
+    }
+
+    function badge(className, text) {
+        const span = document.createElement('span');
+        span.className = 'badge ' + className;
+        span.textContent = text;
+        return span;
+    }
+
+    function cell(content) {
+        const td = document.createElement('td');
+        if (typeof content === 'string') {
+            td.textContent = content;
+        } else {
+            [].concat(content).forEach(node => td.append(node, ' '));
+        }
+        return td;
+    }
+
+    // Same markup as a row of files_table.html
+    function buildRow(file) {
+        const row = document.createElement('tr');
+        row.dataset.fileId = file.id;
+        if (file.status === 'expired') {
+            row.className = 'expired';
+        }
+
+        const checkbox = document.createElement('input');
+        checkbox.type = 'checkbox';
+        checkbox.name = 'file_ids';
+        checkbox.value = file.id;
+        checkbox.setAttribute('form', 'zipForm');
+
+        const badges = [statusBadge(file.status)];
+        if (file.storage_state === 'pending') {
+            badges.push(badge('badge-info', 'Transferring'));
+        }
+
+        const download = document.createElement('a');
+        download.href = section.dataset.downloadUrl.replace(/\/0$/, '/' + file.id);
+        download.className = 'btn btn-sm btn-primary';
+        download.textContent = 'Download';
+
+        const deleteForm = document.createElement('form');
+        deleteForm.method = 'POST';
+        deleteForm.action = section.dataset.deleteUrl.replace(/\/0$/, '/' + file.id);
+        deleteForm.style.display = 'inline';
+        deleteForm.setAttribute('onsubmit', "return confirm('Are you sure you want to delete this file?');");
+        const deleteButton = document.createElement('button');
+        deleteButton.type = 'submit';
+        deleteButton.className = 'btn btn-sm btn-danger';
+        deleteButton.textContent = 'Delete';
+        deleteForm.append(deleteButton);
+
+        const actions = cell([download, deleteForm]);
+        actions.className = 'actions';
+
+        row.append(
+            cell(checkbox),
+            cell(file.filename),
+            cell((file.file_size / 1024).toFixed(2) + ' KB'),
+            cell(formatTime(file.upload_time)),
+            cell(formatTime(file.expiry_time)),
+            cell(badges),
+            actions
+        );
+        return row;
+    }
+
+    // "YYYY-MM-DD HH:MM" in UTC, as the server renders it
+    function formatTime(isoTime) {
+        return isoTime.slice(0, 16).replace('T', ' ');
+    }
+
+    // Deletes and scheduler runs go over fetch; the table is patched by the events they cause.
+    // Cancelled confirmations have already prevented the submit.
+    section.addEventListener('submit', function(e) {
+        const form = e.target;
+        if (e.defaultPrevented || !form.action.includes('/delete/') || !window.liveUpdatesConnected) {
+            return;
+        }
+        e.preventDefault();
+        postForm(form);
+    });
+
+    const schedulerForm = document.getElementById('schedulerForm');
+    schedulerForm.addEventListener('submit', function(e) {
+        if (!e.defaultPrevented && window.liveUpdatesConnected) {
+            e.preventDefault();
+            postForm(schedulerForm);
+        }
+    });
+
+    async function postForm(form) {
+        const button = form.querySelector('button[type="submit"]');
+        button.disabled = true;
+        try {
+            const response = await fetch(form.action, {method: 'POST', headers: {'Accept': 'application/json'}});
+            const result = await response.json();
+            if (!response.ok) {
+                throw new Error(result.error);
+            }
+        } catch (err) {
+            alert(err.message);
+        } finally {
+            button.disabled = false;
+        }
+    }
+});
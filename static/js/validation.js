@@ -39,12 +39,35 @@ document.addEventListener('DOMContentLoaded', function() {
                 return false;
             }
             
-            // Check file size (16MB limit)
+            // Check file size (limit comes from the server, 16MB by default)
+            const maxSize = parseInt(uploadForm.dataset.maxSize) || 16 * 1024 * 1024;
+            const tooLarge = Array.from(fileInput.files).find(file => file.size > maxSize);
+            if (tooLarge) {
+                e.preventDefault();
+                alert('"' + tooLarge.name + '" exceeds the ' + Math.floor(maxSize / (1024 * 1024)) + 'MB limit!');
+                return false;
+            }
+            
+            // Several files go to the batch endpoint in a single request
+            if (fileInput.files.length > 1) {
+                e.preventDefault();
+                batchUpload(uploadForm, fileInput.files, parseInt(expiryDays));
+                return false;
+            }
+            
             const file = fileInput.files[0];
-            const maxSize = 16 * 1024 * 1024; // 16MB
-            if (file.size > maxSize) {
+            
+            // Direct-to-S3 upload: the server only signs and records the upload
+            if (uploadForm.dataset.presignUrl) {
+                e.preventDefault();
+                directUpload(uploadForm, file, parseInt(expiryDays));
+                return false;
+            }
+            
+            // With live updates the new row arrives as an event, so skip the page reload
+            if (window.liveUpdatesConnected) {
                 e.preventDefault();
-                alert('File size exceeds 16MB limit!');
+                formUpload(uploadForm);
                 return false;
             }
         });
@@ -66,3 +89,107 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 });
 
+// Upload a file straight to S3 using a presigned POST policy
+async function directUpload(form, file, expiryDays) {
+    const submitButton = form.querySelector('button[type="submit"]');
+    submitButton.disabled = true;
+    
+    try {
+        const presignResponse = await fetch(form.dataset.presignUrl, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({filename: file.name, size: file.size, expiry_days: expiryDays})
+        });
+        const presign = await presignResponse.json();
+        if (!presignResponse.ok) {
+            throw new Error(presign.error);
+        }
+        
+        // Policy fields must come before the file in the form body
+        const formData = new FormData();
+        Object.entries(presign.fields).forEach(([name, value]) => formData.append(name, value));
+        formData.append('file', file);
+        
+        const uploadResponse = await fetch(presign.url, {method: 'POST', body: formData});
+        if (!uploadResponse.ok) {
+            throw new Error('Upload to storage failed (' + uploadResponse.status + ')');
+        }
+        
+        const completeResponse = await fetch(form.dataset.completeUrl, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({token: presign.token})
+        });
+        const completed = await completeResponse.json();
+        if (!completeResponse.ok) {
+            throw new Error(completed.error);
+        }
+        
+        refreshFiles(form);
+    } catch (err) {
+        alert('Upload failed: ' + err.message);
+        submitButton.disabled = false;
+    }
+}
+
+// Post the upload form in the background and keep the page as it is
+async function formUpload(form) {
+    const submitButton = form.querySelector('button[type="submit"]');
+    submitButton.disabled = true;
+    
+    try {
+        const response = await fetch(form.action, {
+            method: 'POST',
+            headers: {'Accept': 'application/json'},
+            body: new FormData(form)
+        });
+        const uploaded = await response.json();
+        if (!response.ok) {
+            throw new Error(uploaded.error);
+        }
+        
+        refreshFiles(form);
+    } catch (err) {
+        alert(err.message);
+        submitButton.disabled = false;
+    }
+}
+
+// Upload several files in one request and report the ones that failed
+async function batchUpload(form, files, expiryDays) {
+    const submitButton = form.querySelector('button[type="submit"]');
+    submitButton.disabled = true;
+    
+    try {
+        const formData = new FormData();
+        formData.append('expiry_days', expiryDays);
+        Array.from(files).forEach(file => formData.append('files', file));
+        
+        const response = await fetch(form.dataset.batchUrl, {method: 'POST', body: formData});
+        const summary = await response.json();
+        if (!summary.files) {
+            throw new Error(summary.error);
+        }
+        
+        const failures = summary.files.filter(result => result.status !== 'uploaded');
+        if (failures.length > 0) {
+            alert(summary.uploaded + ' of ' + summary.files.length + ' files uploaded.\n\n' +
+                  failures.map(result => result.name + ': ' + result.error).join('\n'));
+        }
+        
+        refreshFiles(form);
+    } catch (err) {
+        alert('Upload failed: ' + err.message);
+        submitButton.disabled = false;
+    }
+}
+
+// With live updates connected the new rows arrive as events; otherwise reload
+function refreshFiles(form) {
+    if (!window.liveUpdatesConnected) {
+        window.location.reload();
+        return;
+    }
+    form.reset();
+    form.querySelector('button[type="submit"]').disabled = false;
+}
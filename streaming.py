@@ -0,0 +1,215 @@
+"""
+Streaming Upload Utility
+Parses multipart/form-data request bodies incrementally so uploaded files
+are written to storage as bytes arrive instead of being spooled first
+"""
+from werkzeug.sansio.multipart import MultipartDecoder, Field, File, Data, Epilogue, NeedData
+from werkzeug.http import parse_options_header
+from config import UPLOAD_STREAM_CHUNK_SIZE, COMPRESSION_LEVEL
+import hashlib
+import os
+import zlib
+
+
+class UploadRejected(Exception):
+    """Raised when an upload is refused while its body is being streamed"""
+
+
+class UploadTooLarge(UploadRejected):
+    """Raised as soon as a streamed file grows past the size limit"""
+
+
+class LocalFileUpload:
+    """
+    Write a streamed upload to the local filesystem
+
+    Data goes to a temporary file next to the destination, which is only
+    renamed into place once the upload completes.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.temp_path = f"{filepath}.part"
+        self.file = open(self.temp_path, 'wb')
+        self.bytes_written = 0
+
+    def write(self, data):
+        """Append data to the temporary file"""
+        self.file.write(data)
+        self.bytes_written += len(data)
+
+    def complete(self):
+        """
+        Move the finished file into place
+
+        Returns:
+            tuple: (success: bool, filepath: str or error_message: str)
+        """
+        try:
+            self.file.close()
+            os.replace(self.temp_path, self.filepath)
+            return True, self.filepath
+        except Exception as e:
+            self.abort()
+            return False, f"Upload error: {str(e)}"
+
+    def abort(self):
+        """Remove the partially written file"""
+        self.file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+class HashingUpload:
+    """Wrap an upload writer and compute the SHA-256 of everything written through it"""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.hash = hashlib.sha256()
+        self.bytes_written = 0
+
+    @property
+    def sha256(self):
+        return self.hash.hexdigest()
+
+    def write(self, data):
+        self.hash.update(data)
+        self.bytes_written += len(data)
+        self.writer.write(data)
+
+    def complete(self):
+        return self.writer.complete()
+
+    def abort(self):
+        self.writer.abort()
+
+
+class CompressingUpload:
+    """Wrap an upload writer and gzip everything written through it"""
+
+    def __init__(self, writer, level=COMPRESSION_LEVEL):
+        self.writer = writer
+        # wbits 16 + MAX_WBITS writes a gzip container (with a zero mtime, so output is deterministic)
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def write(self, data):
+        compressed = self.compressor.compress(data)
+        if compressed:
+            self.writer.write(compressed)
+
+    def flush(self):
+        """Write out the rest of the compressed stream; nothing may be written afterwards"""
+        self.writer.write(self.compressor.flush())
+
+    def complete(self):
+        self.flush()
+        return self.writer.complete()
+
+    def abort(self):
+        self.writer.abort()
+
+
+def decompress_chunks(chunks):
+    """Decompress an iterator of gzip data chunks into chunks of the original bytes"""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    data = decompressor.flush()
+    if data:
+        yield data
+
+
+def _chunk_iter(stream, chunk_size):
+    """Read the request body in chunks, ending with None like werkzeug's parser"""
+    while True:
+        data = stream.read(chunk_size)
+        if not data:
+            break
+        yield data
+    yield None
+
+
+def stream_multipart_upload(stream, content_type, open_upload, max_size, chunk_size=UPLOAD_STREAM_CHUNK_SIZE):
+    """
+    Stream the first file in a multipart/form-data body into storage
+
+    Form fields are collected as they are parsed. When the file part starts,
+    open_upload(filename, content_type, fields) is called with the fields
+    seen so far and must return a writer with write(), complete() and
+    abort() methods (S3MultipartUpload or LocalFileUpload). File data is fed
+    to the writer as it arrives, so at most one chunk of the body and the
+    writer's own buffer are held in memory.
+
+    Args:
+        stream: Raw request body stream (request.stream)
+        content_type: Request Content-Type header including the boundary
+        open_upload: Callback returning a writer for the file part
+        max_size: Maximum file size in bytes, enforced while streaming
+        chunk_size: Bytes read from the stream at a time
+
+    Returns:
+        tuple: (fields: dict, upload: dict or None) where upload holds the
+        'filename', 'size', 'writer' and 'result' of the completed writer
+
+    Raises:
+        UploadRejected: If the body is malformed or open_upload refuses it
+        UploadTooLarge: If the file exceeds max_size (the writer is aborted)
+    """
+    mimetype, options = parse_options_header(content_type)
+    boundary = options.get('boundary', '').encode('latin-1')
+    if mimetype != 'multipart/form-data' or not boundary:
+        raise UploadRejected('Expected a multipart/form-data upload.')
+
+    decoder = MultipartDecoder(boundary, max_form_memory_size=chunk_size * 4)
+    fields = {}
+    upload = None
+    current = None
+    field_data = []
+    writer = None
+
+    try:
+        for data in _chunk_iter(stream, chunk_size):
+            decoder.receive_data(data)
+            event = decoder.next_event()
+            while not isinstance(event, (Epilogue, NeedData)):
+                if isinstance(event, Field):
+                    current = event
+                    field_data = []
+                elif isinstance(event, File):
+                    current = event
+                    if event.name == 'file' and upload is None:
+                        part_type = event.headers.get('Content-Type') or 'application/octet-stream'
+                        writer = open_upload(event.filename, part_type, fields)
+                        upload = {'filename': event.filename, 'size': 0, 'writer': writer}
+                elif isinstance(event, Data):
+                    if isinstance(current, Field):
+                        field_data.append(event.data)
+                        if not event.more_data:
+                            fields[current.name] = b''.join(field_data).decode('utf-8', 'replace')
+                    elif writer is not None:
+                        upload['size'] += len(event.data)
+                        if upload['size'] > max_size:
+                            raise UploadTooLarge(
+                                f'File size exceeds maximum allowed size ({max_size // (1024*1024)}MB).'
+                            )
+                        writer.write(event.data)
+                        if not event.more_data:
+                            success, result = writer.complete()
+                            writer = None
+                            if not success:
+                                raise UploadRejected(f'Upload failed: {result}')
+                            upload['result'] = result
+                event = decoder.next_event()
+    except Exception:
+        if writer is not None:
+            writer.abort()
+        raise
+
+    if writer is not None:
+        # Body ended before the file part was terminated
+        writer.abort()
+        raise UploadRejected('Upload was interrupted.')
+
+    return fields, upload
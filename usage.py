@@ -0,0 +1,122 @@
+"""
+Storage Usage
+Per-user totals (bytes stored, file count) kept in one user_usage row and
+adjusted in the same transaction as every file insert and delete, so the
+dashboard and quota checks read them without scanning the user's files.
+The row also carries a listing version, bumped with every change, that
+cached listings are keyed on. How many files are expiring soon depends on
+the time as well, so it is counted when asked for (see
+listing.expiring_count) rather than stored.
+"""
+from models import db, File, UserUsage
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+
+def usage_totals(user_ids=None):
+    """
+    Totals computed from the files table
+
+    Returns:
+        dict: user_id -> (total_bytes, file_count)
+    """
+    query = db.session.query(
+        File.user_id,
+        func.coalesce(func.sum(File.file_size), 0),
+        func.count(File.id)
+    ).group_by(File.user_id)
+    if user_ids is not None:
+        query = query.filter(File.user_id.in_(user_ids))
+    return {user_id: (int(size), count) for user_id, size, count in query}
+
+
+def adjust_usage(user_id, size_delta=0, count_delta=0):
+    """
+    Add to a user's counters as part of the caller's transaction
+
+    Counters are incremented in SQL, so concurrent uploads and deletes
+    don't overwrite each other, and the listing version is bumped. A user
+    without a row yet (one created before the counters existed) gets it
+    built from the files table, which already reflects the change once it
+    is flushed.
+    """
+    updated = UserUsage.query.filter_by(user_id=user_id).update({
+        UserUsage.total_bytes: UserUsage.total_bytes + size_delta,
+        UserUsage.file_count: UserUsage.file_count + count_delta,
+        UserUsage.listing_version: UserUsage.listing_version + 1
+    }, synchronize_session=False)
+    if updated:
+        return
+
+    db.session.flush()
+    total_bytes, file_count = usage_totals([user_id]).get(user_id, (0, 0))
+    try:
+        with db.session.begin_nested():
+            db.session.add(UserUsage(
+                user_id=user_id,
+                total_bytes=total_bytes,
+                file_count=file_count,
+                listing_version=1
+            ))
+    except IntegrityError:
+        # Created by a concurrent request in the meantime
+        adjust_usage(user_id, size_delta, count_delta)
+
+
+def file_added(file_record):
+    """Count a newly inserted file"""
+    adjust_usage(file_record.user_id, file_record.file_size or 0, 1)
+
+
+def file_removed(file_record):
+    """Uncount a deleted file"""
+    adjust_usage(file_record.user_id, -(file_record.file_size or 0), -1)
+
+
+def touch_listing(user_id):
+    """Bump a user's listing version for a change that leaves the counters alone"""
+    adjust_usage(user_id)
+
+
+def get_usage(user_id):
+    """
+    A user's counters, read from their usage row
+
+    Returns:
+        UserUsage: Stored row, or an unsaved all-zero one for users without files
+    """
+    return db.session.get(UserUsage, user_id) or UserUsage(
+        user_id=user_id, total_bytes=0, file_count=0, listing_version=0
+    )
+
+
+def reconcile_usage():
+    """
+    Rebuild every user's counters from the files table and commit
+
+    Usage rows are locked before the totals are read, so uploads and
+    deletes committing meanwhile are applied on top of the rebuilt values.
+    
+    Returns:
+        int: Number of users whose counters were missing or had drifted
+    """
+    rows = {usage.user_id: usage for usage in UserUsage.query.with_for_update().all()}
+    totals = usage_totals()
+    drifted = 0
+
+    for user_id in set(totals) | set(rows):
+        total_bytes, file_count = totals.get(user_id, (0, 0))
+        usage = rows.get(user_id)
+        if usage is None:
+            usage = UserUsage(user_id=user_id)
+            db.session.add(usage)
+        elif (usage.total_bytes, usage.file_count) == (total_bytes, file_count):
+            continue
+        usage.total_bytes = total_bytes
+        usage.file_count = file_count
+        usage.listing_version = (usage.listing_version or 0) + 1
+        drifted += 1
+        print(f"[Usage] Reconciled user {user_id}: {file_count} file(s), {total_bytes} bytes")
+
+    db.session.commit()
+    return drifted